@@ -0,0 +1,236 @@
+from __future__ import print_function, division
+from builtins import range
+import time
+import tracemalloc
+
+import numpy as np
+
+from cs231n import optim
+from cs231n.solver import Solver
+
+"""
+Small micro-benchmarks for the building blocks in this package. Each function
+returns a dictionary of measurements and, with verbose=True, prints them.
+"""
+
+
+def benchmark_update_rule(update_rule, shape=(4096, 4096), dtype=np.float32,
+                          num_iters=10, config=None, seed=0):
+    """
+    Measure the time and the temporary memory of one parameter update.
+
+    Inputs:
+    - update_rule: Name of an update rule in optim.py, or the function itself.
+    - shape: Shape of the weight matrix to update.
+    - dtype: numpy datatype of the weights and gradients.
+    - num_iters: Number of timed updates, after one untimed warm-up update
+      that lets the update rule allocate its state.
+    - config: Optional config dictionary for the update rule.
+    - seed: Random seed for the weights and gradients.
+
+    Returns a dictionary with keys:
+    - time_per_update: Average wall-clock seconds per update.
+    - peak_temp_bytes: Peak memory allocated during a single update on top of
+      what was allocated before it, in bytes.
+    - temporaries: peak_temp_bytes divided by the size of the weights, i.e.
+      the number of weight-sized temporary arrays alive at the peak.
+    """
+    if isinstance(update_rule, str):
+        update_rule = getattr(optim, update_rule)
+    rng = np.random.RandomState(seed)
+    w = rng.randn(*shape).astype(dtype)
+    dw = rng.randn(*shape).astype(dtype)
+    config = dict(config or {})
+
+    w, config = update_rule(w, dw, config)
+
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        w, config = update_rule(w, dw, config)
+    time_per_update = (time.perf_counter() - start) / num_iters
+
+    # Trace the memory allocated by a single update; numpy reports its
+    # array allocations to tracemalloc
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    w, config = update_rule(w, dw, config)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    peak_temp_bytes = max(peak - base, 0)
+    return {
+      'time_per_update': time_per_update,
+      'peak_temp_bytes': peak_temp_bytes,
+      'temporaries': peak_temp_bytes / w.nbytes,
+    }
+
+
+def compare_update_rules(rules=('sgd_momentum', 'sgd_momentum_inplace',
+                                'rmsprop', 'rmsprop_inplace',
+                                'adam', 'adam_inplace'),
+                         shape=(4096, 4096), dtype=np.float32, num_iters=10,
+                         verbose=True):
+    """
+    Run benchmark_update_rule for several update rules on the same shape.
+
+    Returns a dictionary mapping each rule name to its measurements.
+    """
+    results = {}
+    for rule in rules:
+        results[rule] = benchmark_update_rule(rule, shape=shape, dtype=dtype,
+                                              num_iters=num_iters)
+        if verbose:
+            r = results[rule]
+            print('%-22s %8.2f ms/update  %5.2f temporaries' % (
+                  rule, 1e3 * r['time_per_update'], r['temporaries']))
+    return results
+
+
+def time_to_accuracy(model_fn, data, batch_sizes, target_acc,
+                     update_rule='lars', optim_config=None, base_batch_size=None,
+                     lr_scaling='linear', max_epochs=10, num_val_samples=None,
+                     seed=0, verbose=True, **solver_kwargs):
+    """
+    Measure how long training takes to reach a validation accuracy for
+    several batch sizes.
+
+    For every batch size a fresh model is trained with Solver.train(); an
+    epoch_callback stops training at the end of the first epoch whose
+    validation accuracy reaches target_acc, or after max_epochs. The time is
+    the wall-clock time of train(), so it includes everything a normal run
+    does at the end of each epoch, such as the accuracy checks.
+
+    Inputs:
+    - model_fn: Function with no arguments returning a new model, such as
+      lambda: FullyConnectedNet([100, 100], dtype=np.float32).
+    - data: Dictionary of data as expected by Solver.
+    - batch_sizes: List of batch sizes to try.
+    - target_acc: Validation accuracy to train to.
+    - update_rule, optim_config: Passed to the Solver.
+    - base_batch_size: If not None, the learning rate in optim_config is
+      taken to be tuned for this batch size and is rescaled for the others.
+    - lr_scaling: How to rescale the learning rate when base_batch_size is
+      given: 'linear' multiplies it by batch_size / base_batch_size and
+      'sqrt' by the square root of that.
+    - max_epochs: Maximum number of epochs to train for per batch size.
+    - num_val_samples: Passed to the Solver; if not None, check accuracy on
+      this many validation samples only.
+    - seed: Random seed set before building and training every model.
+    - solver_kwargs: Any other Solver options, such as flat_params.
+
+    Returns a dictionary mapping each batch size to a dictionary with keys:
+    - time_to_target: Seconds of training until target_acc was reached, or
+      None if it was not reached.
+    - epochs_to_target: Number of epochs until target_acc was reached, or
+      None.
+    - best_val_acc: Best validation accuracy seen.
+    - samples_per_sec: Training throughput, over the whole call to train().
+    - val_acc_history: Validation accuracy after the first iteration and
+      after every epoch, as in Solver.val_acc_history.
+    """
+    if lr_scaling not in ('linear', 'sqrt'):
+        raise ValueError('Invalid lr_scaling "%s"' % lr_scaling)
+    results = {}
+    for batch_size in batch_sizes:
+        config = dict(optim_config or {})
+        if base_batch_size is not None and 'learning_rate' in config:
+            scale = batch_size / base_batch_size
+            if lr_scaling == 'sqrt':
+                scale = np.sqrt(scale)
+            config['learning_rate'] *= scale
+
+        reached = {}
+        def stop_at_target(solver):
+            if solver.val_acc_history[-1] >= target_acc:
+                reached['time'] = time.perf_counter() - start
+                reached['epochs'] = solver.epoch
+                return True
+            return False
+
+        np.random.seed(seed)
+        solver = Solver(model_fn(), data, update_rule=update_rule,
+                        optim_config=config, batch_size=batch_size,
+                        num_epochs=max_epochs, num_val_samples=num_val_samples,
+                        epoch_callback=stop_at_target, verbose=False,
+                        **solver_kwargs)
+        start = time.perf_counter()
+        solver.train()
+        elapsed = time.perf_counter() - start
+
+        results[batch_size] = {
+          'time_to_target': reached.get('time'),
+          'epochs_to_target': reached.get('epochs'),
+          'best_val_acc': solver.best_val_acc,
+          'samples_per_sec': (solver.iteration * batch_size / elapsed
+                              if elapsed > 0 else 0.0),
+          'val_acc_history': solver.val_acc_history,
+        }
+        if verbose:
+            r = results[batch_size]
+            status = ('%.2f s (%d epochs)' % (r['time_to_target'],
+                                             r['epochs_to_target'])
+                      if r['time_to_target'] is not None else 'not reached')
+            print('batch %6d  %-20s best val acc %.3f  %8.0f samples/s' % (
+                  batch_size, status, r['best_val_acc'], r['samples_per_sec']))
+    return results
+
+
+def benchmark_conv(algorithms=None, x_shape=(50, 3, 32, 32),
+                   w_shape=(32, 3, 7, 7), stride=1, pad=None,
+                   dtype=np.float32, num_iters=3, seed=0, verbose=True):
+    """
+    Time the forward and backward pass of convolution algorithms from
+    fast_layers.CONV_ALGORITHMS on one shape.
+
+    Inputs:
+    - algorithms: List of algorithm names; defaults to all registered ones
+      that support the shape.
+    - x_shape, w_shape, stride: Shapes of the input and filters, and stride.
+    - pad: Zero padding; defaults to (HH - 1) // 2.
+    - dtype, num_iters, seed: As in benchmark_update_rule; the fastest of
+      num_iters runs counts.
+
+    Returns a dictionary mapping each algorithm name to a dictionary with
+    keys 'forward' and 'backward' giving seconds per call, and 'max_error'
+    giving the largest absolute difference of its output from that of the
+    first algorithm.
+    """
+    from cs231n import fast_layers
+
+    if pad is None:
+        pad = (w_shape[2] - 1) // 2
+    conv_param = {'stride': stride, 'pad': pad}
+    rng = np.random.RandomState(seed)
+    x = rng.randn(*x_shape).astype(dtype)
+    w = rng.randn(*w_shape).astype(dtype)
+    b = rng.randn(w_shape[0]).astype(dtype)
+
+    if algorithms is None:
+        algorithms = [name for name, (_, _, supports)
+                      in fast_layers.CONV_ALGORITHMS.items()
+                      if supports is None or supports(x.shape, w.shape,
+                                                      conv_param)]
+    results = {}
+    reference = None
+    for name in algorithms:
+        forward, backward, _ = fast_layers.CONV_ALGORITHMS[name]
+        t_forward = t_backward = float('inf')
+        for _ in range(num_iters):
+            start = time.perf_counter()
+            out, cache = forward(x, w, b, conv_param)
+            t_forward = min(t_forward, time.perf_counter() - start)
+            start = time.perf_counter()
+            backward(out, cache)
+            t_backward = min(t_backward, time.perf_counter() - start)
+        if reference is None:
+            reference = out
+        results[name] = {
+          'forward': t_forward,
+          'backward': t_backward,
+          'max_error': float(np.abs(out - reference).max()),
+        }
+        if verbose:
+            print('%-10s forward %8.2f ms  backward %8.2f ms  max error %.2e' % (
+                  name, 1e3 * t_forward, 1e3 * t_backward,
+                  results[name]['max_error']))
+    return results
@@ -0,0 +1,169 @@
+from __future__ import print_function, division
+from builtins import object
+import copy
+import json
+import os
+import threading
+
+import numpy as np
+from six.moves import queue
+
+
+def _to_json(obj):
+    """
+    Fallback for json.dump that converts numpy scalars and arrays.
+    """
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError('%r is not JSON serializable' % (obj,))
+
+
+def _atomic_write(path, write):
+    """
+    Call write(f) on a temporary file next to path and rename it into place,
+    so readers never see a partially written file.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def write_checkpoint(prefix, arrays, meta):
+    """
+    Synchronously write one checkpoint as prefix.npz holding the arrays and
+    prefix.json holding the metadata. The .json file is written last, so a
+    checkpoint is complete once its .json file exists.
+
+    Inputs:
+    - prefix: Path of the checkpoint without extension.
+    - arrays: Dictionary mapping names to numpy arrays.
+    - meta: JSON-serializable dictionary of metadata.
+
+    Returns a tuple of the paths written.
+    """
+    npz_path, json_path = prefix + '.npz', prefix + '.json'
+    _atomic_write(npz_path, lambda f: np.savez(f, **arrays))
+    meta_bytes = json.dumps(meta, default=_to_json).encode('utf-8')
+    _atomic_write(json_path, lambda f: f.write(meta_bytes))
+    return npz_path, json_path
+
+
+def read_checkpoint(prefix):
+    """
+    Read a checkpoint written by write_checkpoint.
+
+    Returns a tuple of:
+    - arrays: Dictionary mapping names to numpy arrays.
+    - meta: Dictionary of metadata.
+    """
+    if prefix.endswith('.npz') or prefix.endswith('.json'):
+        prefix = os.path.splitext(prefix)[0]
+    with open(prefix + '.json', 'r') as f:
+        meta = json.load(f)
+    with np.load(prefix + '.npz') as data:
+        arrays = {k: data[k] for k in data.files}
+    return arrays, meta
+
+
+class CheckpointWriter(object):
+    """
+    A CheckpointWriter writes checkpoints on a background thread so that the
+    training thread only pays for copying the parameters. Old checkpoints are
+    deleted according to a keep-last-N / keep-best retention policy.
+
+    Only checkpoints written by this writer are subject to retention; files
+    left behind by earlier runs are never touched.
+    """
+
+    def __init__(self, keep_last=None, keep_best=False):
+        """
+        Inputs:
+        - keep_last: If not None, only the keep_last most recent checkpoints
+          are kept on disk.
+        - keep_best: If True, the checkpoint with the highest score is also
+          kept even if it is older than the last keep_last checkpoints.
+        """
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.written = []
+        self._error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is not None and self._error is None:
+                    prefix, arrays, meta, score = job
+                    paths = write_checkpoint(prefix, arrays, meta)
+                    self.written = [w for w in self.written if w[1] != paths]
+                    self.written.append((score, paths))
+                    self._apply_retention()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+            if job is None:
+                return
+
+
+    def _apply_retention(self):
+        if self.keep_last is None:
+            return
+        keep = set(range(max(len(self.written) - self.keep_last, 0),
+                         len(self.written)))
+        if self.keep_best:
+            scores = [score for score, _ in self.written]
+            keep.add(int(np.argmax(scores)))
+        kept = []
+        for i, (score, paths) in enumerate(self.written):
+            if i in keep:
+                kept.append((score, paths))
+                continue
+            # Remove the .json first so a half-deleted checkpoint is never
+            # mistaken for a complete one
+            for path in reversed(paths):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.written = kept
+
+
+    def _raise_error(self):
+        if self._error is not None:
+            e, self._error = self._error, None
+            raise e
+
+
+    def save(self, prefix, arrays, meta, score=0.0):
+        """
+        Queue a checkpoint to be written; see write_checkpoint. The arrays and
+        metadata are copied before this returns, so the caller may keep
+        updating them. score is used by the keep_best retention policy.
+        """
+        self._raise_error()
+        snapshot = {k: np.array(v, copy=True) for k, v in arrays.items()}
+        self._queue.put((prefix, snapshot, copy.deepcopy(meta), score))
+
+
+    def flush(self):
+        """
+        Block until every queued checkpoint has been written.
+        """
+        self._queue.join()
+        self._raise_error()
+
+
+    def close(self):
+        """
+        Write any queued checkpoints and stop the background thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
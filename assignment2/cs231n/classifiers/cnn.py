@@ -4,6 +4,8 @@ import numpy as np
 from cs231n.layers import *
 from cs231n.fast_layers import *
 from cs231n.layer_utils import *
+from cs231n.dtype_policy import resolve_dtype, cast
+from cs231n.grad_mode import is_grad_enabled, no_grad
 
 
 class ThreeLayerConvNet(object):
@@ -19,7 +21,7 @@ class ThreeLayerConvNet(object):
 
     def __init__(self, input_dim=(3, 32, 32), num_filters=32, filter_size=7,
                  hidden_dim=100, num_classes=10, weight_scale=1e-3, reg=0.0,
-                 dtype=np.float32):
+                 dtype=None, checkpoint=False, checkpoint_chunk_size=10):
         """
         Initialize a new network.
 
@@ -32,11 +34,23 @@ class ThreeLayerConvNet(object):
         - weight_scale: Scalar giving standard deviation for random initialization
           of weights.
         - reg: Scalar giving L2 regularization strength
-        - dtype: numpy datatype to use for computation.
+        - dtype: numpy datatype to use for computation. If None, the dtype
+          policy is used, falling back to float32.
+        - checkpoint: If True, the conv - relu - pool block keeps no cache
+          during the training-time forward pass. In the backward pass it is
+          recomputed from X and backpropagated checkpoint_chunk_size examples
+          at a time, so the conv layer's intermediate arrays and activations
+          only ever exist for one chunk. This lowers peak memory at the cost
+          of a second forward pass of the block; the gradients of W1 and b1
+          are summed over the chunks, so they match the unchecked model up to
+          floating point rounding.
+        - checkpoint_chunk_size: Number of examples per recomputed chunk.
         """
         self.params = {}
         self.reg = reg
-        self.dtype = dtype
+        self.checkpoint = checkpoint
+        self.checkpoint_chunk_size = checkpoint_chunk_size
+        self.dtype = resolve_dtype(dtype, np.float32)
 
         ############################################################################
         # TODO: Initialize weights and biases for the three-layer convolutional    #
@@ -61,7 +75,7 @@ class ThreeLayerConvNet(object):
         ############################################################################
 
         for k, v in self.params.items():
-            self.params[k] = v.astype(dtype)
+            self.params[k] = v.astype(self.dtype)
 
 
     def loss(self, X, y=None):
@@ -70,6 +84,12 @@ class ThreeLayerConvNet(object):
 
         Input / output: Same API as TwoLayerNet in fc_net.py.
         """
+        if y is None and is_grad_enabled():
+            # Test time: run the forward pass without backward caches
+            with no_grad():
+                return self.loss(X)
+
+        X = cast(X, self.dtype, 'ThreeLayerConvNet.loss')
         W1, b1 = self.params['W1'], self.params['b1']
         W2, b2 = self.params['W2'], self.params['b2']
         W3, b3 = self.params['W3'], self.params['b3']
@@ -88,7 +108,17 @@ class ThreeLayerConvNet(object):
         # computing the class scores for X and storing them in the scores          #
         # variable.                                                                #
         ############################################################################
-        pool_out, cache = conv_relu_pool_forward(X, W1, b1, conv_param, pool_param)
+        if self.checkpoint and y is not None:
+            # Run the no-grad forward pass and the recompute with the conv
+            # algorithm tuned for training, so the recomputed activations are
+            # bitwise the same as without checkpointing
+            conv_param['algorithm'] = get_conv_autotuner().choose(
+                X, W1, b1, conv_param)
+            with no_grad():
+                pool_out, _ = conv_relu_pool_forward(X, W1, b1, conv_param, pool_param)
+            cache = None
+        else:
+            pool_out, cache = conv_relu_pool_forward(X, W1, b1, conv_param, pool_param)
         X2, fc_cache = affine_relu_forward(pool_out, W2, b2)
         scores, fc2_cache = affine_forward(X2, W3, b3)
         ############################################################################
@@ -113,7 +143,22 @@ class ThreeLayerConvNet(object):
         # backpropagation of gradients
         dout, grads['W3'], grads['b3'] = affine_backward(softmax_grad, fc2_cache)
         dout, grads['W2'], grads['b2'] = affine_relu_backward(dout, fc_cache)
-        dout, grads['W1'], grads['b1'] = conv_relu_pool_backward(dout, cache)
+        del fc_cache, fc2_cache
+        if cache is None:
+            # Recompute the conv - relu - pool block that was checkpointed and
+            # backpropagate through it one chunk of examples at a time
+            grads['W1'], grads['b1'] = np.zeros_like(W1), np.zeros_like(b1)
+            chunk = self.checkpoint_chunk_size
+            for start in range(0, X.shape[0], chunk):
+                _, cache = conv_relu_pool_forward(X[start:start + chunk], W1, b1,
+                                                  conv_param, pool_param)
+                _, dW1, db1 = conv_relu_pool_backward(dout[start:start + chunk],
+                                                      cache)
+                cache = None
+                grads['W1'] += dW1
+                grads['b1'] += db1
+        else:
+            dout, grads['W1'], grads['b1'] = conv_relu_pool_backward(dout, cache)
         
         # L2 regularization
         grads['W1'] += self.reg * W1
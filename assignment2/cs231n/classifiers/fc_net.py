@@ -1,9 +1,13 @@
 from builtins import range
 from builtins import object
+import copy
+
 import numpy as np
 
 from cs231n.layers import *
 from cs231n.layer_utils import *
+from cs231n.dtype_policy import resolve_dtype, cast
+from cs231n.grad_mode import is_grad_enabled, no_grad
 
 
 class TwoLayerNet(object):
@@ -75,6 +79,11 @@ class TwoLayerNet(object):
         - grads: Dictionary with the same keys as self.params, mapping parameter
           names to gradients of the loss with respect to those parameters.
         """
+        if y is None and is_grad_enabled():
+            # Test time: run the forward pass without backward caches
+            with no_grad():
+                return self.loss(X)
+
         scores = None
         ############################################################################
         # TODO: Implement the forward pass for the two-layer net, computing the    #
@@ -141,7 +150,8 @@ class FullyConnectedNet(object):
 
     def __init__(self, hidden_dims, input_dim=3*32*32, num_classes=10,
                  dropout=0, use_batchnorm=False, reg=0.0,
-                 weight_scale=1e-2, dtype=np.float32, seed=None):
+                 weight_scale=1e-2, dtype=None, seed=None,
+                 checkpoint_every=None):
         """
         Initialize a new FullyConnectedNet.
 
@@ -157,16 +167,24 @@ class FullyConnectedNet(object):
           initialization of the weights.
         - dtype: A numpy datatype object; all computations will be performed using
           this datatype. float32 is faster but less accurate, so you should use
-          float64 for numeric gradient checking.
+          float64 for numeric gradient checking. If None, the dtype policy is
+          used, falling back to float32.
         - seed: If not None, then pass this random seed to the dropout layers. This
           will make the dropout layers deteriminstic so we can gradient check the
           model.
+        - checkpoint_every: If not None, an integer k enabling activation
+          checkpointing: during training only the input of every k-th hidden
+          layer is kept, and the layers in between are recomputed one segment
+          at a time during the backward pass. This costs one extra forward
+          pass through the hidden layers; k around sqrt(L) keeps activation
+          memory O(sqrt(L)) instead of O(L).
         """
         self.use_batchnorm = use_batchnorm
+        self.checkpoint_every = checkpoint_every
         self.use_dropout = dropout > 0
         self.reg = reg
         self.num_layers = 1 + len(hidden_dims)
-        self.dtype = dtype
+        self.dtype = resolve_dtype(dtype, np.float32)
         self.params = {}
         ############################################################################
         # TODO: Initialize the parameters of the network, storing all values in    #
@@ -212,7 +230,7 @@ class FullyConnectedNet(object):
 
         # Cast all parameters to the correct datatype
         for k, v in self.params.items():
-            self.params[k] = v.astype(dtype)
+            self.params[k] = v.astype(self.dtype)
 
 
     def loss(self, X, y=None):
@@ -221,7 +239,12 @@ class FullyConnectedNet(object):
 
         Input / output: Same as TwoLayerNet above.
         """
-        X = X.astype(self.dtype)
+        if y is None and is_grad_enabled():
+            # Test time: run the forward pass without backward caches
+            with no_grad():
+                return self.loss(X)
+
+        X = cast(X, self.dtype, 'FullyConnectedNet.loss')
         mode = 'test' if y is None else 'train'
 
         # Set train/test mode for batchnorm params and dropout param since they
@@ -248,16 +271,15 @@ class FullyConnectedNet(object):
         #{affine - [batch norm] - relu - [dropout]} x (L - 1) - affine - softmax
         x = X
         Caches = []
-        gamma, beta, bn_params = None, None, None
-        for i in range(self.num_layers-1):
-            w = self.params['W'+str(i+1)]
-            b = self.params['b'+str(i+1)]
-            if self.use_batchnorm != False:
-                gamma = self.params['gamma'+str(i+1)]
-                beta = self.params['beta'+str(i+1)]
-                bn_params = self.bn_params[i]
-            x,cache = affine_norm_relu_forward(x, w, b, gamma, beta, self.use_batchnorm, bn_params, self.use_dropout, self.dropout_param)
-            Caches.append(cache)
+        checkpointing = mode == 'train' and self.checkpoint_every is not None
+        if checkpointing:
+            x, saved, dropout_params = self._checkpointed_forward(X)
+            Caches = [None] * (self.num_layers-1)
+        else:
+            for i in range(self.num_layers-1):
+                bn_params = self.bn_params[i] if self.use_batchnorm else None
+                x,cache = self._hidden_forward(i, x, bn_params, self.dropout_param)
+                Caches.append(cache)
         scores, cache = affine_forward(x, self.params['W'+str(self.num_layers)], self.params['b'+str(self.num_layers)])
         Caches.append(cache)
             
@@ -289,12 +311,17 @@ class FullyConnectedNet(object):
             loss += 0.5 * self.reg * np.sum(w*w)
         
         # gradient
-        dout, dw, db = affine_backward(softmax_grad, Caches[self.num_layers-1])
+        dout, dw, db = affine_backward(softmax_grad, Caches[-1])
         grads['W'+str(self.num_layers)] = dw + 2*0.5*self.reg*self.params['W'+str(self.num_layers)]
         grads['b'+str(self.num_layers)] = db
         
         for i in range(self.num_layers-2, -1, -1):
+            if Caches[i] is None:
+                # Recompute the caches of the segment that ends at layer i
+                start, x = saved.pop()
+                self._recompute_segment(start, x, Caches, dropout_params)
             dx, dw, db, dgamma, dbeta = affine_norm_relu_backward(dout, Caches[i], self.use_batchnorm, self.use_dropout)
+            Caches[i] = None
             
             if self.use_batchnorm:
                 grads['gamma'+str(i+1)] = dgamma
@@ -307,16 +334,100 @@ class FullyConnectedNet(object):
         ############################################################################
 
         return loss, grads
-    
-    
+
+
+    def _hidden_forward(self, i, x, bn_param, dropout_param):
+        """
+        Forward pass of hidden layer i (counting from 0).
+        """
+        w = self.params['W'+str(i+1)]
+        b = self.params['b'+str(i+1)]
+        gamma, beta = None, None
+        if self.use_batchnorm:
+            gamma = self.params['gamma'+str(i+1)]
+            beta = self.params['beta'+str(i+1)]
+        return affine_norm_relu_forward(x, w, b, gamma, beta, self.use_batchnorm, bn_param, self.use_dropout, dropout_param)
+
+
+    def _checkpointed_forward(self, X):
+        """
+        Training-time forward pass through the hidden layers that keeps no
+        caches, only the input of every checkpoint_every-th layer.
+
+        Returns a tuple of:
+        - out: Output of the last hidden layer.
+        - saved: List of tuples (i, x) giving the input x of hidden layer i
+          for the first layer of every segment.
+        - dropout_params: List giving the dropout_param used for every hidden
+          layer, with the key of its dropout mask fixed as the seed so that
+          recomputing the layer draws the same mask.
+        """
+        x = X
+        saved, dropout_params = [], []
+        for i in range(self.num_layers-1):
+            dropout_param = dict(self.dropout_param)
+            if self.use_dropout:
+                dropout_param['seed'] = dropout_key(self.dropout_param)
+            dropout_params.append(dropout_param)
+            if i % self.checkpoint_every == 0:
+                saved.append((i, x))
+            bn_param = self.bn_params[i] if self.use_batchnorm else None
+            with no_grad():
+                x, _ = self._hidden_forward(i, x, bn_param, dropout_param)
+        return x, saved, dropout_params
+
+
+    def _recompute_segment(self, start, x, Caches, dropout_params):
+        """
+        Recompute the hidden layers of the segment starting at layer start from
+        its saved input x, storing their caches in Caches.
+        """
+        end = min(start + self.checkpoint_every, self.num_layers-1)
+        for i in range(start, end):
+            # The batchnorm running averages were updated by the first forward
+            # pass; update a copy so they are not updated twice
+            bn_param = dict(self.bn_params[i]) if self.use_batchnorm else None
+            x, Caches[i] = self._hidden_forward(i, x, bn_param, dropout_params[i])
+
+
+    def fold_batchnorm(self):
+        """
+        Export an inference copy of this network with every batch normalization
+        layer folded into the affine layer before it, using the running
+        statistics collected during training. The copy has no batchnorm layers
+        and gives the same test-time scores as this network, up to floating
+        point rounding, with one fewer pass over the activations per layer.
+
+        Returns a new FullyConnectedNet; this network is left unchanged.
+        """
+        folded = copy.copy(self)
+        folded.params = {k: v.copy() for k, v in self.params.items()}
+        folded.dropout_param = dict(self.dropout_param)
+        folded.use_batchnorm = False
+        folded.bn_params = []
+        if not self.use_batchnorm:
+            return folded
+
+        for i in range(self.num_layers - 1):
+            W, b = 'W' + str(i+1), 'b' + str(i+1)
+            gamma = folded.params.pop('gamma' + str(i+1))
+            beta = folded.params.pop('beta' + str(i+1))
+            folded.params[W], folded.params[b] = affine_batchnorm_fold(
+                self.params[W], self.params[b], gamma, beta, self.bn_params[i])
+        return folded
+
+
 #{affine - [batch norm] - relu - [dropout]} x (L - 1) - affine - softmax
 def affine_norm_relu_forward(x, w, b, gamma, beta, use_norm, bn_param, use_drop, drop_param):
     fc_cache, bn_cache, relu_cache, drop_cache = None, None, None, None
     
-    out, fc_cache = affine_forward(x, w, b)
     if use_norm:
-        out, bn_cache = batchnorm_forward(out, gamma, beta, bn_param)
-    out, relu_cache = relu_forward(out)
+        # Fused affine - batch norm - relu; its cache takes the place of
+        # fc_cache
+        out, fc_cache = affine_bn_relu_forward(x, w, b, gamma, beta, bn_param)
+    else:
+        out, fc_cache = affine_forward(x, w, b)
+        out, relu_cache = relu_forward_owned(out)
     if use_drop:
         out, drop_cache = dropout_forward(out, drop_param) 
     
@@ -328,11 +439,11 @@ def affine_norm_relu_backward(dout, cache, use_norm, use_drop):
     
     if use_drop:
         dout = dropout_backward(dout, drop_cache)
-    dout = relu_backward(dout, relu_cache)
     if use_norm:
-        dout, dgamma, dbeta = batchnorm_backward(dout, bn_cache)
-    dout, dw, db = affine_backward(dout, fc_cache)
-    dx = dout
+        dx, dw, db, dgamma, dbeta = affine_bn_relu_backward(dout, fc_cache)
+    else:
+        dout = relu_backward(dout, relu_cache)
+        dx, dw, db = affine_backward(dout, fc_cache)
     return dx, dw, db, dgamma, dbeta
    
     
@@ -0,0 +1,213 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import threading
+
+import numpy as np
+from six.moves import queue
+
+
+def epoch_batch_indices(order, pos, batch_size, num_train, rng):
+    """
+    Return the indices of the next minibatch of epoch-based sampling, which
+    slices consecutive minibatches out of a random permutation of the data.
+    When fewer than batch_size examples of the current permutation are left,
+    they start the minibatch and the rest comes from a new permutation, so no
+    example is ever skipped.
+
+    Inputs:
+    - order: The current permutation, or None to start with a new one.
+    - pos: Number of examples of order already used.
+    - batch_size: Size of the minibatch.
+    - num_train: Number of examples in the data.
+    - rng: Random number generator with a permutation() method.
+
+    Returns a tuple of:
+    - batch_indices: Sorted array of the batch_size indices of the minibatch.
+    - order, pos: The permutation and position for the next call.
+    """
+    if order is None:
+        order, pos = rng.permutation(num_train), 0
+    parts = []
+    needed = batch_size
+    while needed > 0:
+        if pos == num_train:
+            order, pos = rng.permutation(num_train), 0
+        take = min(needed, num_train - pos)
+        parts.append(order[pos:pos + take])
+        pos += take
+        needed -= take
+    # Sorting the indices of a minibatch doesn't change which examples it
+    # contains but makes the gather walk memory in order
+    return np.sort(np.concatenate(parts)), order, pos
+
+
+def permute_rows_inplace(arrays, perm):
+    """
+    Reorder the rows of every array in arrays in place so that row i becomes
+    the old row perm[i], following the cycles of the permutation with a
+    single row of temporary memory per array instead of a full copy.
+    """
+    num_rows = len(perm)
+    done = np.zeros(num_rows, dtype=bool)
+    for start in range(num_rows):
+        if done[start]:
+            continue
+        done[start] = True
+        if perm[start] == start:
+            continue
+        saved = [a[start].copy() for a in arrays]
+        i = start
+        while perm[i] != start:
+            j = perm[i]
+            for a in arrays:
+                a[i] = a[j]
+            done[j] = True
+            i = j
+        for a, row in zip(arrays, saved):
+            a[i] = row
+
+
+class PrefetchLoader(object):
+    """
+    A PrefetchLoader assembles minibatches on a background thread so that
+    gathering (and optionally augmenting) the next minibatch overlaps with the
+    forward and backward pass on the current one.
+
+    Minibatches are written into a small pool of preallocated buffers. A batch
+    returned by next_batch() stays valid until the following call to
+    next_batch(), at which point its buffer is handed back to the background
+    thread to be refilled; callers that need to keep a batch around for longer
+    must copy it.
+
+    Example usage:
+
+    loader = PrefetchLoader(data['X_train'], data['y_train'], batch_size=100)
+    solver = Solver(model, data, data_loader=loader, batch_size=100)
+    solver.train()
+
+    Solver.train() closes the loader when it returns; call close() yourself
+    when using the loader without a Solver.
+    """
+
+    def __init__(self, X, y, batch_size, num_buffers=2, augment=None,
+                 sampler='replacement', seed=None):
+        """
+        Construct a new PrefetchLoader and start its background thread.
+
+        Inputs:
+        - X: Array (or array-like object supporting indexing, such as a
+          LazyImageSplit) of shape (N, d_1, ..., d_k) of training data.
+        - y: Array of shape (N,) of training labels.
+        - batch_size: Size of the minibatches to produce.
+        - num_buffers: Number of preallocated batch buffers; this bounds how
+          many batches are prepared ahead of time. Must be at least 2 so that
+          one batch can be filled while another is in use.
+        - augment: If not None, a function that is called on the background
+          thread with a minibatch X_batch and returns an augmented minibatch
+          of the same shape.
+        - sampler: 'replacement' to sample every minibatch independently with
+          replacement, or 'epoch' to slice consecutive minibatches out of a
+          new random permutation of the data each epoch (see
+          epoch_batch_indices).
+        - seed: Seed for the random number generator used to sample
+          minibatches. The loader uses its own generator so it does not race
+          with the global numpy generator used on the training thread.
+        """
+        assert num_buffers >= 2, 'num_buffers must be at least 2'
+        if sampler not in ('replacement', 'epoch'):
+            raise ValueError('Invalid sampler "%s"' % sampler)
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.augment = augment
+        self.sampler = sampler
+        self._epoch_order = None
+        self._epoch_pos = None
+        self.rng = np.random.RandomState(seed)
+
+        x_dtype = getattr(X, 'dtype', np.float64)
+        self._X_bufs = [np.empty((batch_size,) + tuple(X.shape[1:]),
+                                 dtype=x_dtype) for _ in range(num_buffers)]
+        self._y_bufs = [np.empty(batch_size, dtype=np.asarray(y).dtype)
+                        for _ in range(num_buffers)]
+
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        for i in range(num_buffers):
+            self._free.put(i)
+        self._current = None
+        self._error = None
+        self._stop = threading.Event()
+
+        self._thread = threading.Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def _sample_indices(self):
+        num_train = self.X.shape[0]
+        if self.sampler == 'replacement':
+            return self.rng.choice(num_train, self.batch_size)
+
+        idx, self._epoch_order, self._epoch_pos = epoch_batch_indices(
+            self._epoch_order, self._epoch_pos, self.batch_size, num_train,
+            self.rng)
+        return idx
+
+
+    def _fill(self, i):
+        idx = self._sample_indices()
+        X_buf, y_buf = self._X_bufs[i], self._y_bufs[i]
+        if isinstance(self.X, np.ndarray):
+            np.take(self.X, idx, axis=0, out=X_buf)
+        else:
+            X_buf[...] = self.X[idx]
+        np.take(self.y, idx, axis=0, out=y_buf)
+        if self.augment is not None:
+            X_buf[...] = self.augment(X_buf)
+
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                i = self._free.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                self._fill(i)
+            except Exception as e:
+                self._error = e
+                return
+            self._ready.put(i)
+
+
+    def next_batch(self):
+        """
+        Return the next minibatch as a tuple (X_batch, y_batch). This blocks
+        until the background thread has finished preparing it. If the
+        background thread failed, the exception it raised is raised here.
+        """
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+        while True:
+            try:
+                i = self._ready.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self._thread.is_alive():
+                    continue
+                if self._error is not None:
+                    raise self._error
+                raise RuntimeError('PrefetchLoader is closed')
+        self._current = i
+        return self._X_bufs[i], self._y_bufs[i]
+
+
+    def close(self):
+        """
+        Stop the background thread.
+        """
+        self._stop.set()
+        self._thread.join()
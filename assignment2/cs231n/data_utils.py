@@ -3,9 +3,13 @@ from __future__ import print_function
 from six.moves import cPickle as pickle
 import numpy as np
 import os
+import json
 # from scipy.misc import imread # this is deprecated
 from imageio import imread # replace with this
 import platform
+from multiprocessing.pool import ThreadPool
+
+from cs231n.dtype_policy import resolve_dtype
 
 def load_pickle(f):
     version = platform.python_version_tuple()
@@ -15,42 +19,72 @@ def load_pickle(f):
         return  pickle.load(f, encoding='latin1')
     raise ValueError("invalid python version: {}".format(version))
 
-def load_CIFAR_batch(filename):
+def load_CIFAR_batch(filename, dtype=None):
   """ load single batch of cifar """
   with open(filename, 'rb') as f:
     datadict = load_pickle(f)
     X = datadict['data']
     Y = datadict['labels']
-    X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype("float")
+    dtype = resolve_dtype(dtype, "float")
+    X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype(dtype)
     Y = np.array(Y)
     return X, Y
 
-def load_CIFAR10(ROOT):
+def load_CIFAR10(ROOT, dtype=None):
   """ load all of cifar """
   xs = []
   ys = []
   for b in range(1,6):
     f = os.path.join(ROOT, 'data_batch_%d' % (b, ))
-    X, Y = load_CIFAR_batch(f)
+    X, Y = load_CIFAR_batch(f, dtype)
     xs.append(X)
     ys.append(Y)    
   Xtr = np.concatenate(xs)
   Ytr = np.concatenate(ys)
   del X, Y
-  Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'))
+  Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'), dtype)
   return Xtr, Ytr, Xte, Yte
 
 
 def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
-                     subtract_mean=True):
+                     subtract_mean=True, lazy=False, dtype=None):
     """
     Load the CIFAR-10 dataset from disk and perform preprocessing to prepare
     it for classifiers. These are the same steps as we used for the SVM, but
     condensed to a single function.
+
+    If lazy is True then the images are kept as uint8 in their original
+    (N, H, W, C) layout and the X_* entries are LazyImageSplit objects that
+    subtract the mean image, transpose to (N, C, H, W) and cast to float only
+    for the rows that are indexed. These can be passed directly to a Solver.
+
+    dtype gives the datatype of the returned images; if None, the dtype policy
+    is used, falling back to float64.
     """
+    dtype = resolve_dtype(dtype, "float")
     # Load the raw CIFAR-10 data
     cifar10_dir = 'cs231n/datasets/cifar-10-batches-py'
-    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir)
+    if lazy:
+      X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir, np.uint8)
+      X_val = X_train[num_training:num_training + num_validation]
+      y_val = y_train[num_training:num_training + num_validation]
+      X_train = X_train[:num_training]
+      y_train = y_train[:num_training]
+      X_test = X_test[:num_test]
+      y_test = y_test[:num_test]
+
+      mean_image = None
+      if subtract_mean:
+        mean_image = np.mean(X_train, axis=0)
+      split = lambda X: LazyImageSplit(X, mean_image, dtype, (0, 3, 1, 2))
+
+      return {
+        'X_train': split(X_train), 'y_train': y_train,
+        'X_val': split(X_val), 'y_val': y_val,
+        'X_test': split(X_test), 'y_test': y_test,
+      }
+
+    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir, dtype)
         
     # Subsample the data
     mask = list(range(num_training, num_training + num_validation))
@@ -83,7 +117,7 @@ def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
     }
     
 
-def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
+def load_tiny_imagenet(path, dtype=None, subtract_mean=True):
   """
   Load TinyImageNet. Each of TinyImageNet-100-A, TinyImageNet-100-B, and
   TinyImageNet-200 have the same directory structure, so this can be used
@@ -91,7 +125,8 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
 
   Inputs:
   - path: String giving path to the directory to load.
-  - dtype: numpy datatype used to load the data.
+  - dtype: numpy datatype used to load the data. If None, the dtype policy is
+    used, falling back to float32.
   - subtract_mean: Whether to subtract the mean training image.
 
   Returns: A dictionary with the following entries:
@@ -106,6 +141,8 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
     (such as in student code) then y_test will be None.
   - mean_image: (3, 64, 64) array giving mean training image
   """
+  dtype = resolve_dtype(dtype, np.float32)
+
   # First load wnids
   with open(os.path.join(path, 'wnids.txt'), 'r') as f:
     wnids = [x.strip() for x in f]
@@ -116,7 +153,7 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
   # Use words.txt to get names for each class
   with open(os.path.join(path, 'words.txt'), 'r') as f:
     wnid_to_words = dict(line.split('\t') for line in f)
-    for wnid, words in wnid_to_words.iteritems():
+    for wnid, words in wnid_to_words.items():
       wnid_to_words[wnid] = [w.strip() for w in words.split(',')]
   class_names = [wnid_to_words[wnid] for wnid in wnids]
 
@@ -208,24 +245,329 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
   }
 
 
-def load_models(models_dir):
+
+class LazyImageSplit(object):
+  """
+  A read-only wrapper around a (possibly memory-mapped) array of raw uint8
+  images. Rows are converted to a floating point dtype and have the mean image
+  subtracted only when they are indexed, so a minibatch only pays for the rows
+  it actually touches.
+
+  The wrapper exposes shape, dtype, len() and indexing, which is all that the
+  Solver needs from X_train / X_val.
+  """
+
+  def __init__(self, data, mean_image=None, dtype=np.float32, transpose=None):
+    """
+    Inputs:
+    - data: Array of shape (N, d_1, ..., d_k) holding raw image data.
+    - mean_image: If not None, array of shape (d_1, ..., d_k) that is
+      subtracted from every row that is read.
+    - dtype: numpy datatype of the returned rows.
+    - transpose: If not None, a permutation of the axes of data (as for
+      np.transpose) applied to every returned batch; for example (0, 3, 1, 2)
+      turns (N, H, W, C) storage into (N, C, H, W) batches. Axis 0 must stay
+      first.
+    """
+    self.data = data
+    self.dtype = np.dtype(dtype)
+    self.transpose = None
+    if transpose is not None:
+      self.transpose = tuple(transpose)
+      assert self.transpose[0] == 0, 'Cannot move the batch axis'
+    self.mean_image = None
+    if mean_image is not None:
+      mean_image = np.asarray(mean_image, dtype=self.dtype)
+      if self.transpose is not None:
+        mean_image = mean_image.transpose(self._row_axes())
+      self.mean_image = np.ascontiguousarray(mean_image)
+
+  def _row_axes(self):
+    return [a - 1 for a in self.transpose[1:]]
+
+  @property
+  def shape(self):
+    if self.transpose is not None:
+      return tuple(self.data.shape[a] for a in self.transpose)
+    return self.data.shape
+
+  @property
+  def ndim(self):
+    return self.data.ndim
+
+  def __len__(self):
+    return self.data.shape[0]
+
+  def __getitem__(self, idx):
+    rows = self.data[idx]
+    if self.transpose is not None:
+      if rows.ndim == self.data.ndim:
+        rows = rows.transpose(self.transpose)
+      else:
+        rows = rows.transpose(self._row_axes())
+    out = np.array(rows, dtype=self.dtype, order='C')
+    if self.mean_image is not None:
+      out -= self.mean_image
+    return out
+
+
+def pack_tiny_imagenet(path, packed_path):
+  """
+  Decode TinyImageNet once and write it to a compact on-disk format that can
+  later be memory-mapped by load_tiny_imagenet_packed. Images are stored as
+  uint8, which is a quarter of the size of the float32 arrays returned by
+  load_tiny_imagenet.
+
+  Inputs:
+  - path: String giving path to the TinyImageNet directory to load.
+  - packed_path: String giving path to the directory to write; it will be
+    created if it does not exist. It will contain one .npy file per array
+    and a meta.json file with the class names.
+  """
+  data = load_tiny_imagenet(path, dtype=np.uint8, subtract_mean=False)
+
+  if not os.path.isdir(packed_path):
+    os.makedirs(packed_path)
+  for k in ['X_train', 'y_train', 'X_val', 'y_val', 'X_test', 'y_test',
+            'mean_image']:
+    if data[k] is not None:
+      np.save(os.path.join(packed_path, '%s.npy' % k), data[k])
+
+  with open(os.path.join(path, 'wnids.txt'), 'r') as f:
+    wnids = [x.strip() for x in f]
+  meta = {
+    'wnids': wnids,
+    'class_names': data['class_names'],
+  }
+  with open(os.path.join(packed_path, 'meta.json'), 'w') as f:
+    json.dump(meta, f)
+
+
+def load_tiny_imagenet_packed(packed_path, dtype=None,
+                              subtract_mean=True):
+  """
+  Load a TinyImageNet directory written by pack_tiny_imagenet. The uint8
+  images are memory-mapped rather than read into memory, and the X_* entries
+  are LazyImageSplit objects that convert and mean-subtract only the rows that
+  are indexed.
+
+  Inputs:
+  - packed_path: String giving path to the packed directory.
+  - dtype: numpy datatype of the rows returned by the X_* entries. If None,
+    the dtype policy is used, falling back to float32.
+  - subtract_mean: Whether to subtract the mean training image.
+
+  Returns: A dictionary with the same entries as load_tiny_imagenet, plus:
+  - wnids: A list where wnids[i] is the WordNet id of class i.
+  """
+  dtype = resolve_dtype(dtype, np.float32)
+
+  def load(name):
+    f = os.path.join(packed_path, '%s.npy' % name)
+    if not os.path.isfile(f):
+      return None
+    return np.load(f, mmap_mode='r')
+
+  with open(os.path.join(packed_path, 'meta.json'), 'r') as f:
+    meta = json.load(f)
+
+  mean_image = np.load(os.path.join(packed_path, 'mean_image.npy'))
+  split_mean = mean_image if subtract_mean else None
+
+  return {
+    'class_names': meta['class_names'],
+    'wnids': meta['wnids'],
+    'X_train': LazyImageSplit(load('X_train'), split_mean, dtype),
+    'y_train': np.asarray(load('y_train')),
+    'X_val': LazyImageSplit(load('X_val'), split_mean, dtype),
+    'y_val': np.asarray(load('y_val')),
+    'X_test': LazyImageSplit(load('X_test'), split_mean, dtype),
+    'y_test': None if load('y_test') is None else np.asarray(load('y_test')),
+    'mean_image': mean_image.astype(dtype),
+  }
+
+
+def _model_summary(model):
+  """ small JSON-friendly description of a model's architecture """
+  params = getattr(model, 'params', {})
+  return {
+    'class': type(model).__name__,
+    'params': {k: list(np.shape(v)) for k, v in params.items()},
+    'num_params': int(sum(np.size(v) for v in params.values())),
+  }
+
+
+class ModelHandle(object):
+  """
+  A lazy reference to a model saved on disk. The file is only unpickled the
+  first time the model attribute is accessed, or the first time the summary
+  is needed if it was not already known from an index.
+
+  Attributes:
+  - name: File name of the model inside its directory.
+  - path: Full path to the model file.
+  - size: File size in bytes.
+  - mtime: File modification time.
+  - summary: Dictionary with the model class name, the shape of every
+    parameter and the total number of parameters.
+  """
+
+  def __init__(self, path, size, mtime, summary=None, model=None):
+    self.name = os.path.basename(path)
+    self.path = path
+    self.size = size
+    self.mtime = mtime
+    self._summary = summary
+    self._model = model
+
+  @property
+  def loaded(self):
+    return self._model is not None
+
+  @property
+  def model(self):
+    if self._model is None:
+      with open(self.path, 'rb') as f:
+        self._model = load_pickle(f)['model']
+    return self._model
+
+  @property
+  def summary(self):
+    if self._summary is None:
+      self._summary = _model_summary(self.model)
+    return self._summary
+
+  def __repr__(self):
+    if self._summary is None:
+      return 'ModelHandle(%r, %d bytes)' % (self.name, self.size)
+    return 'ModelHandle(%r, %s, %d bytes)' % (
+      self.name, self._summary['class'], self.size)
+
+
+def index_models(models_dir, index_path=None, use_cache=True,
+                 keep_loaded=False):
+  """
+  Build an index of the saved models in a directory.
+
+  Without an index_path nothing is unpickled: every file gets a handle whose
+  summary is computed on first access, so files that are not models (such as
+  README.txt) are only found out when they are used. With an index_path,
+  every file is unpickled once to compute its summary and the results are
+  stored in that JSON file and reused on later calls for every file whose
+  size and modification time have not changed, so unchanged files are not
+  unpickled again; files that give errors on unpickling are then left out of
+  the index.
+
+  Inputs:
+  - models_dir: String giving the path to a directory containing model files.
+  - index_path: If not None, path of the JSON file used to cache the index.
+    Nothing is written to disk unless it is given.
+  - use_cache: If False, ignore any existing index file and rebuild it.
+  - keep_loaded: True to keep every model that is unpickled while building
+    the index loaded in its handle, or a list of model file names to keep
+    only those loaded.
+
+  Returns:
+  A dictionary mapping model file names to ModelHandle objects.
+  """
+  if keep_loaded is True or keep_loaded is False:
+    keep = lambda model_file: keep_loaded
+  else:
+    keep_loaded = set(keep_loaded)
+    keep = lambda model_file: model_file in keep_loaded
+
+  cached = {}
+  if index_path is not None and use_cache and os.path.isfile(index_path):
+    with open(index_path, 'r') as f:
+      cached = json.load(f)
+
+  entries = {}
+  handles = {}
+  for model_file in sorted(os.listdir(models_dir)):
+    path = os.path.join(models_dir, model_file)
+    if not os.path.isfile(path):
+      continue
+    st = os.stat(path)
+    if index_path is None:
+      handles[model_file] = ModelHandle(path, st.st_size, st.st_mtime)
+      continue
+    if os.path.abspath(path) == os.path.abspath(index_path):
+      continue
+    entry = cached.get(model_file)
+    model = None
+    if (entry is None or entry['size'] != st.st_size or
+        entry['mtime'] != st.st_mtime):
+      entry = {'size': st.st_size, 'mtime': st.st_mtime, 'summary': None}
+      with open(path, 'rb') as f:
+        try:
+          model = load_pickle(f)['model']
+        except pickle.UnpicklingError:
+          pass
+      if model is not None:
+        entry['summary'] = _model_summary(model)
+    entries[model_file] = entry
+    if entry['summary'] is not None:
+      handles[model_file] = ModelHandle(path, entry['size'], entry['mtime'],
+                                        entry['summary'],
+                                        model if keep(model_file) else None)
+
+  if index_path is not None and entries != cached:
+    with open(index_path, 'w') as f:
+      json.dump(entries, f)
+
+  return handles
+
+
+def _try_load(handle):
+  try:
+    return handle.model
+  except pickle.UnpicklingError:
+    return None
+
+
+def load_models(models_dir, names=None, lazy=False, index_path=None,
+                num_workers=1):
   """
   Load saved models from disk. This will attempt to unpickle all files in a
   directory; any files that give errors on unpickling (such as README.txt) will
-  be skipped.
+  be skipped. If names is given, only those files are read.
 
   Inputs:
   - models_dir: String giving the path to a directory containing model files.
     Each model file is a pickled dictionary with a 'model' field.
+  - names: If not None, a list of model file names to load; other files are
+    not unpickled (unless an index has to be built, see index_models).
+  - lazy: If True, return ModelHandle objects that unpickle their model on
+    first access instead of the models themselves.
+  - index_path: Passed to index_models to cache the index of the directory.
+  - num_workers: Number of threads used to read the selected models in
+    parallel; ignored when lazy is True. Reading a large file releases the
+    GIL, so this helps when loading is bound by disk I/O.
 
   Returns:
-  A dictionary mapping model file names to models.
+  A dictionary mapping model file names to models (or to ModelHandle objects
+  if lazy is True).
   """
-  models = {}
-  for model_file in os.listdir(models_dir):
-    with open(os.path.join(models_dir, model_file), 'rb') as f:
-      try:
-        models[model_file] = load_pickle(f)['model']
-      except pickle.UnpicklingError:
-        continue
-  return models
+  if lazy:
+    keep_loaded = False
+  else:
+    keep_loaded = True if names is None else names
+  handles = index_models(models_dir, index_path=index_path,
+                         keep_loaded=keep_loaded)
+  if names is not None:
+    handles = {name: handles[name] for name in names}
+  if lazy:
+    return handles
+
+  handles = list(handles.values())
+  if num_workers > 1:
+    pool = ThreadPool(num_workers)
+    try:
+      models = pool.map(_try_load, handles)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    models = [_try_load(h) for h in handles]
+  return {h.name: model for h, model in zip(handles, models)
+          if model is not None}
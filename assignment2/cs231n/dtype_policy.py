@@ -0,0 +1,92 @@
+"""
+A single dtype policy shared by the data loaders in data_utils.py, the models
+in classifiers/, the layers in layers.py and the update rules in optim.py.
+
+By default no policy dtype is set and every function keeps its historical
+default (float64 for CIFAR-10, float32 for the models, etc). Calling
+
+set_dtype_policy(np.float32)
+
+makes every loader and model that was not given an explicit dtype use float32,
+so a whole training run stays in float32. Passing debug=True additionally
+emits a DtypeWarning every time an array is copied to change its dtype or a
+computation produces a wider dtype than expected, which makes it easy to find
+silent upcasts.
+"""
+
+import warnings
+
+import numpy as np
+
+
+class DtypeWarning(UserWarning):
+    pass
+
+
+class DtypePolicy(object):
+    """
+    Holds the dtype used by default for data and parameters, and whether
+    dtype conversions should be reported.
+    """
+
+    def __init__(self, dtype=None, debug=False):
+        """
+        Inputs:
+        - dtype: A numpy datatype, or None to keep the per-function defaults.
+        - debug: If True, report dtype copies and upcasts as DtypeWarnings.
+        """
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.debug = debug
+
+
+_policy = DtypePolicy()
+
+
+def set_dtype_policy(dtype=None, debug=False):
+    """
+    Install a new global dtype policy and return it.
+    """
+    global _policy
+    _policy = DtypePolicy(dtype, debug)
+    return _policy
+
+
+def get_dtype_policy():
+    return _policy
+
+
+def resolve_dtype(dtype, default):
+    """
+    Pick the dtype for a function that accepts an optional dtype argument: an
+    explicit dtype wins, then the policy dtype, then the function's default.
+    """
+    if dtype is not None:
+        return np.dtype(dtype)
+    if _policy.dtype is not None:
+        return _policy.dtype
+    return np.dtype(default)
+
+
+def cast(x, dtype, where):
+    """
+    Return x as an array of the given dtype, copying only if needed. In debug
+    mode the copy is reported.
+    """
+    dtype = np.dtype(dtype)
+    if x.dtype == dtype:
+        return x
+    if _policy.debug:
+        warnings.warn('%s: copying %s array of shape %s to %s' % (
+                      where, x.dtype, x.shape, dtype), DtypeWarning,
+                      stacklevel=2)
+    return x.astype(dtype)
+
+
+def check_dtype(x, dtype, where):
+    """
+    In debug mode, report if x has a wider dtype than expected.
+    """
+    if _policy.debug and x.dtype != dtype:
+        if np.promote_types(x.dtype, dtype) == x.dtype:
+            warnings.warn('%s: %s upcast to %s' % (where, np.dtype(dtype),
+                          x.dtype), DtypeWarning, stacklevel=2)
@@ -1,14 +1,24 @@
 from __future__ import print_function
+from builtins import object
+from collections import OrderedDict
+import json
+import os
+import time
+
 import numpy as np
+from cs231n.im2col import *
+from cs231n.grad_mode import is_grad_enabled
+
+# The Cython extension is optional; build it by running
+# python setup.py build_ext --inplace
+# from the cs231n directory. Without it the functions below fall back to the
+# pure numpy versions in im2col.py, which give the same results.
 try:
     from cs231n.im2col_cython import col2im_cython, im2col_cython
     from cs231n.im2col_cython import col2im_6d_cython
+    HAVE_CYTHON = True
 except ImportError:
-    print('run the following from the cs231n directory and try again:')
-    print('python setup.py build_ext --inplace')
-    print('You may also need to restart your iPython kernel')
-
-from cs231n.im2col import *
+    HAVE_CYTHON = False
 
 
 def conv_forward_im2col(x, w, b, conv_param):
@@ -29,22 +39,45 @@ def conv_forward_im2col(x, w, b, conv_param):
     out_width = (W + 2 * pad - filter_width) // stride + 1
     out = np.zeros((N, num_filters, out_height, out_width), dtype=x.dtype)
 
-    # x_cols = im2col_indices(x, w.shape[2], w.shape[3], pad, stride)
-    x_cols = im2col_cython(x, w.shape[2], w.shape[3], pad, stride)
+    if HAVE_CYTHON:
+        x_cols = im2col_cython(x, w.shape[2], w.shape[3], pad, stride)
+    else:
+        x_cols = im2col_indices(x, w.shape[2], w.shape[3], pad, stride)
     res = w.reshape((w.shape[0], -1)).dot(x_cols) + b.reshape(-1, 1)
 
     out = res.reshape(w.shape[0], out.shape[2], out.shape[3], x.shape[0])
     out = out.transpose(3, 0, 1, 2)
 
-    cache = (x, w, b, conv_param, x_cols)
+    cache = (x, w, b, conv_param, x_cols) if is_grad_enabled() else None
     return out, cache
 
 
+# Without gradients, conv_forward_strides convolves the minibatch in chunks
+# whose im2col matrix takes at most this many bytes, since x_cols is not needed
+# by a backward pass and doesn't have to exist for the whole minibatch at once.
+NO_GRAD_CHUNK_BYTES = 16 * 2**20
+
+
 def conv_forward_strides(x, w, b, conv_param):
     N, C, H, W = x.shape
     F, _, HH, WW = w.shape
     stride, pad = conv_param['stride'], conv_param['pad']
 
+    if not is_grad_enabled():
+        out_h = (H + 2 * pad - HH) // stride + 1
+        out_w = (W + 2 * pad - WW) // stride + 1
+        cols_bytes = C * HH * WW * out_h * out_w * x.itemsize
+        chunk = max(NO_GRAD_CHUNK_BYTES // cols_bytes, 1)
+        if chunk < N:
+            out = None
+            for i in range(0, N, chunk):
+                out_i, _ = conv_forward_strides(x[i:i + chunk], w, b,
+                                                conv_param)
+                if out is None:
+                    out = np.empty((N,) + out_i.shape[1:], dtype=out_i.dtype)
+                out[i:i + chunk] = out_i
+            return out, None
+
     # Check dimensions
     #assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
     #assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
@@ -80,7 +113,7 @@ def conv_forward_strides(x, w, b, conv_param):
     # comparison we won't either
     out = np.ascontiguousarray(out)
 
-    cache = (x, w, b, conv_param, x_cols)
+    cache = (x, w, b, conv_param, x_cols) if is_grad_enabled() else None
     return out, cache
 
 
@@ -99,7 +132,10 @@ def conv_backward_strides(dout, cache):
 
     dx_cols = w.reshape(F, -1).T.dot(dout_reshaped)
     dx_cols.shape = (C, HH, WW, N, out_h, out_w)
-    dx = col2im_6d_cython(dx_cols, N, C, H, W, HH, WW, pad, stride)
+    if HAVE_CYTHON:
+        dx = col2im_6d_cython(dx_cols, N, C, H, W, HH, WW, pad, stride)
+    else:
+        dx = col2im_6d_numpy(dx_cols, N, C, H, W, HH, WW, pad, stride)
 
     return dx, dw, db
 
@@ -119,15 +155,585 @@ def conv_backward_im2col(dout, cache):
     dw = dout_reshaped.dot(x_cols.T).reshape(w.shape)
 
     dx_cols = w.reshape(num_filters, -1).T.dot(dout_reshaped)
-    # dx = col2im_indices(dx_cols, x.shape, filter_height, filter_width, pad, stride)
-    dx = col2im_cython(dx_cols, x.shape[0], x.shape[1], x.shape[2], x.shape[3],
-                       filter_height, filter_width, pad, stride)
+    if HAVE_CYTHON:
+        dx = col2im_cython(dx_cols, x.shape[0], x.shape[1], x.shape[2],
+                           x.shape[3], filter_height, filter_width, pad, stride)
+    else:
+        dx = col2im_indices(dx_cols, x.shape, filter_height, filter_width, pad,
+                            stride)
+
+    return dx, dw, db
+
+
+def _fft_size(n):
+    """
+    Return the smallest integer >= n with no prime factors other than 2, 3
+    and 5, for which FFTs are fast.
+    """
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def conv_forward_fft(x, w, b, conv_param):
+    """
+    An implementation of the forward pass for a convolutional layer based on
+    the FFT. Its cost hardly depends on the filter size, so it beats im2col
+    for large filters.
+
+    The padded input and the filters are transformed once with batched rfft2
+    calls; the sum over input channels then becomes one batched complex
+    matrix multiply over all frequencies, (N, C) x (C, F), followed by a
+    single batched irfft2. Strided convolutions are computed at stride 1 and
+    subsampled.
+
+    Inputs / outputs: Same as conv_forward_naive, except that the cache holds
+    the transformed input and filters for conv_backward_fft.
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    Hp, Wp = H + 2 * pad, W + 2 * pad
+    out_h = (Hp - HH) // stride + 1
+    out_w = (Wp - WW) // stride + 1
+
+    # A circular correlation of this size equals the linear one on all the
+    # output positions we keep
+    shape = (_fft_size(Hp), _fft_size(Wp))
+    x_padded = np.pad(x, ((0, 0), (0, 0), (pad, pad), (pad, pad)),
+                      mode='constant')
+    x_fft = np.fft.rfft2(x_padded, s=shape)
+    w_fft = np.fft.rfft2(w, s=shape).conj()
+
+    # (U, V, N, C) x (U, V, C, F) -> (U, V, N, F)
+    out_fft = np.matmul(x_fft.transpose(2, 3, 0, 1), w_fft.transpose(2, 3, 1, 0))
+    # irfft2 is much faster on contiguous input
+    out_fft = np.ascontiguousarray(out_fft.transpose(2, 3, 0, 1))
+    out = np.fft.irfft2(out_fft, s=shape)
+    out = out[:, :, :stride * (out_h - 1) + 1:stride,
+              :stride * (out_w - 1) + 1:stride]
+    out = (out + b.reshape(1, -1, 1, 1)).astype(x.dtype, copy=False)
+
+    cache = (x.shape, w.shape, conv_param, x_fft, w_fft) if is_grad_enabled() else None
+    return out, cache
+
+
+def conv_backward_fft(dout, cache):
+    """
+    Backward pass for conv_forward_fft. Both gradients reuse the transforms
+    computed by the forward pass: dw is the correlation of the input with
+    dout and dx is the full convolution of dout with the filters, each done
+    as one batched matrix multiply over all frequencies.
+    """
+    x_shape, w_shape, conv_param, x_fft, w_fft = cache
+    N, C, H, W = x_shape
+    F, _, HH, WW = w_shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    _, _, out_h, out_w = dout.shape
+    shape = (_fft_size(H + 2 * pad), _fft_size(W + 2 * pad))
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    # Spread dout back onto the stride 1 output grid
+    if stride > 1:
+        dout_full = np.zeros((N, F, stride * (out_h - 1) + 1,
+                              stride * (out_w - 1) + 1), dtype=dout.dtype)
+        dout_full[:, :, ::stride, ::stride] = dout
+    else:
+        dout_full = dout
+    dout_fft = np.fft.rfft2(dout_full, s=shape)
+    dout_fft = dout_fft.transpose(2, 3, 0, 1)
+
+    # dw: (U, V, C, N) x (U, V, N, F) -> (U, V, C, F)
+    dw_fft = np.matmul(x_fft.transpose(2, 3, 1, 0), dout_fft.conj())
+    dw_fft = np.ascontiguousarray(dw_fft.transpose(3, 2, 0, 1))
+    dw = np.fft.irfft2(dw_fft, s=shape)
+    dw = dw[:, :, :HH, :WW]
+
+    # dx: (U, V, N, F) x (U, V, F, C) -> (U, V, N, C)
+    dx_fft = np.matmul(dout_fft, w_fft.conj().transpose(2, 3, 0, 1))
+    dx_fft = np.ascontiguousarray(dx_fft.transpose(2, 3, 0, 1))
+    dx = np.fft.irfft2(dx_fft, s=shape)
+    dx = dx[:, :, pad:pad + H, pad:pad + W]
+
+    dtype = dout.dtype
+    return (np.ascontiguousarray(dx, dtype=dtype),
+            np.ascontiguousarray(dw, dtype=dtype), db)
+
+
+# The Winograd F(2x2, 3x3) transforms (B^T, G, A^T) and their transposes,
+# applied along one axis: d is a list of the slices of the input along that
+# axis and the results are written to out[0], out[1], ...
+
+def _winograd_bt(d, out):
+    np.subtract(d[0], d[2], out=out[0])
+    np.add(d[1], d[2], out=out[1])
+    np.subtract(d[2], d[1], out=out[2])
+    np.subtract(d[1], d[3], out=out[3])
+
+
+def _winograd_b(d, out):
+    np.copyto(out[0], d[0])
+    np.add(d[1], d[3], out=out[1])
+    out[1] -= d[2]
+    np.add(d[1], d[2], out=out[2])
+    out[2] -= d[0]
+    np.negative(d[3], out=out[3])
+
+
+def _winograd_g(g, out):
+    np.copyto(out[0], g[0])
+    np.add(g[0], g[2], out=out[1])
+    np.subtract(out[1], g[1], out=out[2])
+    out[1] += g[1]
+    out[1] *= 0.5
+    out[2] *= 0.5
+    np.copyto(out[3], g[2])
+
+
+def _winograd_gt(d, out):
+    np.add(d[1], d[2], out=out[0])
+    out[0] *= 0.5
+    np.add(out[0], d[3], out=out[2])
+    out[0] += d[0]
+    np.subtract(d[1], d[2], out=out[1])
+    out[1] *= 0.5
+
+
+def _winograd_at(m, out):
+    np.add(m[0], m[1], out=out[0])
+    out[0] += m[2]
+    np.subtract(m[1], m[2], out=out[1])
+    out[1] -= m[3]
+
+
+def _winograd_a(d, out):
+    np.copyto(out[0], d[0])
+    np.add(d[0], d[1], out=out[1])
+    np.subtract(d[0], d[1], out=out[2])
+    np.negative(d[1], out=out[3])
+
+
+def conv_forward_winograd(x, w, b, conv_param):
+    """
+    An implementation of the forward pass for 3x3 stride 1 convolutional
+    layers based on the Winograd transform F(2x2, 3x3), which computes every
+    2x2 block of outputs from a 4x4 input tile with 16 multiplies per input
+    channel instead of 36.
+
+    The transforms are separable, so all tiles are transformed at once by
+    adding strided slices of the padded input, first along rows and then
+    along columns; the sum over input channels is then one batched matrix
+    multiply, (F, C) x (C, N * tiles), for each of the 16 transformed
+    positions.
+
+    Inputs / outputs: Same as conv_forward_naive; w must have shape
+    (F, C, 3, 3) and conv_param['stride'] must be 1.
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    assert HH == WW == 3 and stride == 1, 'Winograd needs 3x3 stride 1 filters'
+
+    # Pad so that the output is a whole number of 2x2 tiles; 4x4 input tiles
+    # start every 2 pixels
+    out_h, out_w = H + 2 * pad - 2, W + 2 * pad - 2
+    th, tw = (out_h + 1) // 2, (out_w + 1) // 2
+    Hp, Wp = 2 * th + 2, 2 * tw + 2
+    x_padded = np.zeros((C, N, Hp, Wp), dtype=x.dtype)
+    x_padded[:, :, pad:pad + H, pad:pad + W] = x.transpose(1, 0, 2, 3)
+
+    # V = B^T d B for every input tile d
+    t = np.empty((4, C, N, th, Wp), dtype=x.dtype)
+    _winograd_bt([x_padded[:, :, k:k + 2 * th:2] for k in range(4)], t)
+    V = np.empty((4, 4, C, N, th, tw), dtype=x.dtype)
+    _winograd_bt([t[..., k:k + 2 * tw:2] for k in range(4)], V.swapaxes(0, 1))
+    V = V.reshape(16, C, N * th * tw)
+
+    # U = G g G^T for every filter g
+    g = w.transpose(2, 3, 0, 1)
+    t = np.empty((4, 3, F, C), dtype=x.dtype)
+    _winograd_g(g, t)
+    U = np.empty((4, 4, F, C), dtype=x.dtype)
+    _winograd_g([t[:, k] for k in range(3)], U.swapaxes(0, 1))
+    U = U.reshape(16, F, C)
+
+    M = np.matmul(U, V).reshape(4, 4, F, N, th, tw)
+
+    # Y = A^T M A, written straight into the 2x2 blocks of the output
+    t = np.empty((2, 4, F, N, th, tw), dtype=x.dtype)
+    _winograd_at(M, t)
+    out = np.empty((N, F, th, 2, tw, 2), dtype=x.dtype)
+    _winograd_at([t[:, k] for k in range(4)], out.transpose(5, 3, 1, 0, 2, 4))
+    out = out.reshape(N, F, 2 * th, 2 * tw)[:, :, :out_h, :out_w]
+    out = out + b.reshape(1, -1, 1, 1)
+
+    cache = (x.shape, conv_param, U, V, (th, tw)) if is_grad_enabled() else None
+    return out, cache
+
+
+def conv_backward_winograd(dout, cache):
+    """
+    Backward pass for conv_forward_winograd, using the transformed tiles and
+    filters saved by the forward pass: every transform is replaced by its
+    transpose and the batched matrix multiplies give the gradients with
+    respect to the transformed filters and tiles.
+    """
+    x_shape, conv_param, U, V, (th, tw) = cache
+    N, C, H, W = x_shape
+    _, F, _ = U.shape
+    pad = conv_param['pad']
+    _, _, out_h, out_w = dout.shape
+    dtype = dout.dtype
+
+    db = np.sum(dout, axis=(0, 2, 3))
+
+    # dM = A dY A^T
+    dY = np.zeros((N, F, th, 2, tw, 2), dtype=dtype)
+    dY.reshape(N, F, 2 * th, 2 * tw)[:, :, :out_h, :out_w] = dout
+    dY = dY.transpose(3, 5, 1, 0, 2, 4)
+    t = np.empty((4, 2, F, N, th, tw), dtype=dtype)
+    _winograd_a(dY, t)
+    dM = np.empty((4, 4, F, N, th, tw), dtype=dtype)
+    _winograd_a([t[:, k] for k in range(2)], dM.swapaxes(0, 1))
+    dM = dM.reshape(16, F, N * th * tw)
+
+    # dw = G^T dU G
+    dU = np.matmul(dM, V.transpose(0, 2, 1)).reshape(4, 4, F, C)
+    t = np.empty((3, 4, F, C), dtype=dtype)
+    _winograd_gt(dU, t)
+    dw = np.empty((F, C, 3, 3), dtype=dtype)
+    _winograd_gt([t[:, k] for k in range(4)], dw.transpose(3, 2, 0, 1))
+
+    # dd = B dV B^T, added back into the padded input tile by tile
+    dV = np.matmul(U.transpose(0, 2, 1), dM).reshape(4, 4, C, N, th, tw)
+    t = np.empty((4, 4, C, N, th, tw), dtype=dtype)
+    _winograd_b(dV, t)
+    dd = np.empty((4, 4, C, N, th, tw), dtype=dtype)
+    _winograd_b([t[:, k] for k in range(4)], dd.swapaxes(0, 1))
+
+    dx_padded = np.zeros((C, N, 2 * th + 2, 2 * tw + 2), dtype=dtype)
+    for i in range(4):
+        for j in range(4):
+            dx_padded[:, :, i:i + 2 * th:2, j:j + 2 * tw:2] += dd[i, j]
+    dx = dx_padded[:, :, pad:pad + H, pad:pad + W].transpose(1, 0, 2, 3)
+
+    return np.ascontiguousarray(dx), dw, db
+
+
+def _winograd_supports(x_shape, w_shape, conv_param):
+    return w_shape[2] == w_shape[3] == 3 and conv_param['stride'] == 1
+
+
+def conv_forward_1x1(x, w, b, conv_param):
+    """
+    A fast implementation of the forward pass for 1x1 convolutions with
+    stride 1 and no padding, as used in the squeeze and expand layers of
+    SqueezeNet fire modules.
+
+    Such a convolution is a matrix multiply of the (F, C) filters with every
+    (C, H * W) image; x is reshaped to (N, C, H * W) without a copy and a
+    single batched matrix multiply writes the output in NCHW order, so there
+    is no padding, im2col copy or transpose.
+
+    Inputs / outputs: Same as conv_forward_naive; w must have shape
+    (F, C, 1, 1), and conv_param must have stride 1 and pad 0.
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    assert HH == WW == 1, 'conv_forward_1x1 needs 1x1 filters'
+    assert conv_param['stride'] == 1 and conv_param['pad'] == 0, \
+        'conv_forward_1x1 needs stride 1 and pad 0'
+
+    out = np.matmul(w.reshape(F, C), x.reshape(N, C, H * W))
+    out += b.reshape(-1, 1)
+    out = out.reshape(N, F, H, W)
+
+    cache = (x, w) if is_grad_enabled() else None
+    return out, cache
+
+
+def conv_backward_1x1(dout, cache):
+    """
+    Backward pass for conv_forward_1x1; again one batched matrix multiply for
+    each of dx and dw, on the NCHW arrays as they are. (A single
+    (F, N * H * W) x (N * H * W, C) product for dw would first have to copy
+    dout and x into that layout; conv_backward_1x1_nhwc gets it for free.)
+    """
+    x, w = cache
+    N, C, H, W = x.shape
+    F = w.shape[0]
+    dout = dout.reshape(N, F, H * W)
+    x = x.reshape(N, C, H * W)
+
+    db = np.sum(dout, axis=(0, 2))
+    dw = np.matmul(dout, x.transpose(0, 2, 1)).sum(axis=0).reshape(w.shape)
+    dx = np.matmul(w.reshape(F, C).T, dout).reshape(N, C, H, W)
 
     return dx, dw, db
 
 
-conv_forward_fast = conv_forward_strides
-conv_backward_fast = conv_backward_strides
+def conv_forward_1x1_nhwc(x, w, b, conv_param):
+    """
+    Like conv_forward_1x1, but for inputs and outputs stored channels-last.
+    x of shape (N, H, W, C) is then a (N * H * W, C) matrix and the whole
+    layer is a single matrix multiply with the transposed (F, C) filters;
+    BLAS reads the transpose in place, so nothing is copied.
+
+    Inputs:
+    - x: Input data of shape (N, H, W, C)
+    - w: Filter weights of shape (F, C, 1, 1), as for conv_forward_naive
+    - b: Biases, of shape (F,)
+    - conv_param: Must have stride 1 and pad 0.
+
+    Returns a tuple of:
+    - out: Output data, of shape (N, H, W, F)
+    - cache: (x, w)
+    """
+    N, H, W, C = x.shape
+    F, _, HH, WW = w.shape
+    assert HH == WW == 1, 'conv_forward_1x1_nhwc needs 1x1 filters'
+    assert conv_param['stride'] == 1 and conv_param['pad'] == 0, \
+        'conv_forward_1x1_nhwc needs stride 1 and pad 0'
+
+    out = x.reshape(-1, C).dot(w.reshape(F, C).T)
+    out += b
+    out = out.reshape(N, H, W, F)
+
+    cache = (x, w) if is_grad_enabled() else None
+    return out, cache
+
+
+def conv_backward_1x1_nhwc(dout, cache):
+    """
+    Backward pass for conv_forward_1x1_nhwc.
+
+    Inputs:
+    - dout: Upstream derivatives, of shape (N, H, W, F)
+    - cache: (x, w) as in conv_forward_1x1_nhwc
+
+    Returns a tuple of (dx, dw, db) with dx of shape (N, H, W, C) and dw of
+    shape (F, C, 1, 1).
+    """
+    x, w = cache
+    F = w.shape[0]
+    C = x.shape[-1]
+    dout = dout.reshape(-1, F)
+
+    db = np.sum(dout, axis=0)
+    dw = dout.T.dot(x.reshape(-1, C)).reshape(w.shape)
+    dx = dout.dot(w.reshape(F, C)).reshape(x.shape)
+
+    return dx, dw, db
+
+
+def _1x1_supports(x_shape, w_shape, conv_param):
+    return (w_shape[2] == w_shape[3] == 1 and conv_param['stride'] == 1 and
+            conv_param['pad'] == 0)
+
+
+def _im2col_supports(x_shape, w_shape, conv_param):
+    _, _, H, W = x_shape
+    _, _, HH, WW = w_shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    # Without the Cython extension col2im runs in numpy and im2col never beats
+    # the strides algorithm
+    return (HAVE_CYTHON and (H + 2 * pad - HH) % stride == 0 and
+            (W + 2 * pad - WW) % stride == 0)
+
+
+def _fft_supports(x_shape, w_shape, conv_param):
+    # The FFT only pays off for filters larger than 3x3
+    return max(w_shape[2], w_shape[3]) > 3
+
+
+# The convolution algorithms that conv_forward_fast chooses between, in order
+# of preference when timings tie. Each entry maps a name to a tuple
+# (forward, backward, supports) where forward and backward follow the API of
+# conv_forward_naive and conv_backward_naive, and supports is None or a
+# function supports(x_shape, w_shape, conv_param) returning whether the
+# algorithm can handle that shape and is worth timing on it.
+CONV_ALGORITHMS = OrderedDict()
+
+
+def register_conv_algorithm(name, forward, backward, supports=None):
+    """
+    Add a convolution algorithm for the autotuner to choose from.
+    """
+    CONV_ALGORITHMS[name] = (forward, backward, supports)
+
+
+register_conv_algorithm('strides', conv_forward_strides, conv_backward_strides)
+register_conv_algorithm('im2col', conv_forward_im2col, conv_backward_im2col,
+                        _im2col_supports)
+register_conv_algorithm('fft', conv_forward_fft, conv_backward_fft,
+                        _fft_supports)
+register_conv_algorithm('winograd', conv_forward_winograd, conv_backward_winograd,
+                        _winograd_supports)
+register_conv_algorithm('1x1', conv_forward_1x1, conv_backward_1x1,
+                        _1x1_supports)
+
+
+class ConvAutotuner(object):
+    """
+    A ConvAutotuner picks the fastest algorithm in CONV_ALGORITHMS for every
+    convolution shape. The first time a shape is seen, every algorithm that
+    supports it is timed on the actual inputs, and the fastest one is
+    remembered and used for every later call with that shape. With gradients
+    enabled the forward and backward pass are timed together; without
+    gradients (see grad_mode.py) only the forward pass is timed, and the two
+    cases are tuned separately. The batch size is not part of the shape, so
+    the last partial minibatch and the chunks of an accuracy check reuse the
+    decision made for the first batch size seen.
+
+    Since different algorithms round differently, results can differ in the
+    last bits depending on the choice; passing a path makes the choices
+    persist across runs.
+
+    Example usage:
+
+    set_conv_autotuner(path='conv_autotune.json')
+    out, cache = conv_forward_fast(x, w, b, conv_param)
+    print(get_conv_autotuner().decisions())
+    """
+
+    def __init__(self, path=None, num_trials=2):
+        """
+        Inputs:
+        - path: If not None, a JSON file the decisions are loaded from if it
+          exists, and written to after every new decision.
+        - num_trials: Number of timed runs per algorithm; the fastest run
+          counts.
+        """
+        self.path = path
+        self.num_trials = num_trials
+        self._decisions = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as f:
+                self._decisions = json.load(f)
+
+
+    @staticmethod
+    def key(x, w, conv_param):
+        """
+        Return the string under which decisions for these inputs are stored.
+        """
+        return 'x=%s w=%s stride=%d pad=%d %s %s' % (
+            'x'.join(str(d) for d in x.shape[1:]),
+            'x'.join(str(d) for d in w.shape),
+            conv_param['stride'], conv_param['pad'], x.dtype.name,
+            'train' if is_grad_enabled() else 'inference')
+
+
+    def _time(self, forward, backward, x, w, b, conv_param):
+        best = float('inf')
+        for _ in range(self.num_trials):
+            start = time.perf_counter()
+            out, cache = forward(x, w, b, conv_param)
+            if backward is not None:
+                backward(out, cache)
+            best = min(best, time.perf_counter() - start)
+        return best
+
+
+    def choose(self, x, w, b, conv_param):
+        """
+        Return the name of the algorithm to use for these inputs, timing the
+        candidates if this shape has not been seen before.
+        """
+        key = self.key(x, w, conv_param)
+        decision = self._decisions.get(key)
+        if decision is not None and decision['algorithm'] in CONV_ALGORITHMS:
+            return decision['algorithm']
+
+        train = is_grad_enabled()
+        times = {}
+        for name, (forward, backward, supports) in CONV_ALGORITHMS.items():
+            if supports is not None and not supports(x.shape, w.shape,
+                                                     conv_param):
+                continue
+            try:
+                times[name] = self._time(forward, backward if train else None,
+                                         x, w, b, conv_param)
+            except Exception:
+                # An algorithm that fails on this shape is never picked
+                continue
+        if not times:
+            raise ValueError('No convolution algorithm supports %s' % key)
+        best = min(times, key=times.get)
+        self._decisions[key] = {'algorithm': best, 'times': times}
+        if self.path is not None:
+            self.save()
+        return best
+
+
+    def decisions(self):
+        """
+        Return a dictionary mapping the key of every tuned shape to a
+        dictionary with the chosen 'algorithm' and the measured 'times' in
+        seconds of every candidate.
+        """
+        return {k: {'algorithm': d['algorithm'], 'times': dict(d['times'])}
+                for k, d in self._decisions.items()}
+
+
+    def save(self, path=None):
+        """
+        Write the decisions to path, or to self.path.
+        """
+        path = path or self.path
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._decisions, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+_autotuner = ConvAutotuner()
+
+
+def set_conv_autotuner(path=None, num_trials=2):
+    """
+    Install a new global ConvAutotuner, dropping all previous decisions, and
+    return it.
+    """
+    global _autotuner
+    _autotuner = ConvAutotuner(path, num_trials)
+    return _autotuner
+
+
+def get_conv_autotuner():
+    return _autotuner
+
+
+def conv_forward_fast(x, w, b, conv_param):
+    """
+    A fast implementation of the forward pass for a convolutional layer that
+    dispatches to the algorithm the global ConvAutotuner picked for this shape.
+    If conv_param has an 'algorithm' key, that entry of CONV_ALGORITHMS is
+    used instead.
+    """
+    algorithm = conv_param.get('algorithm')
+    if algorithm is None:
+        algorithm = _autotuner.choose(x, w, b, conv_param)
+    forward = CONV_ALGORITHMS[algorithm][0]
+    out, real_cache = forward(x, w, b, conv_param)
+    cache = (algorithm, real_cache) if is_grad_enabled() else None
+    return out, cache
+
+
+def conv_backward_fast(dout, cache):
+    """
+    Backward pass for conv_forward_fast, using the algorithm that computed the
+    forward pass.
+    """
+    algorithm, real_cache = cache
+    backward = CONV_ALGORITHMS[algorithm][1]
+    return backward(dout, real_cache)
 
 
 def max_pool_forward_fast(x, pool_param):
@@ -151,6 +757,8 @@ def max_pool_forward_fast(x, pool_param):
     else:
         out, im2col_cache = max_pool_forward_im2col(x, pool_param)
         cache = ('im2col', im2col_cache)
+    if not is_grad_enabled():
+        cache = None
     return out, cache
 
 
@@ -187,7 +795,7 @@ def max_pool_forward_reshape(x, pool_param):
                            W // pool_width, pool_width)
     out = x_reshaped.max(axis=3).max(axis=4)
 
-    cache = (x, x_reshaped, out)
+    cache = (x, x_reshaped, out) if is_grad_enabled() else None
     return out, cache
 
 
@@ -245,7 +853,7 @@ def max_pool_forward_im2col(x, pool_param):
     x_cols_max = x_cols[x_cols_argmax, np.arange(x_cols.shape[1])]
     out = x_cols_max.reshape(out_height, out_width, N, C).transpose(2, 3, 0, 1)
 
-    cache = (x, x_cols, x_cols_argmax, pool_param)
+    cache = (x, x_cols, x_cols_argmax, pool_param) if is_grad_enabled() else None
     return out, cache
 
 
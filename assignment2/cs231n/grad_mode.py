@@ -0,0 +1,51 @@
+from builtins import object
+
+"""
+A global switch that tells the forward passes in layers.py and fast_layers.py
+whether a backward pass will follow.
+
+Gradients are enabled by default and every forward pass returns a cache for
+its backward pass. Inside a no_grad block the forward passes return None
+instead of a cache, so nothing that is only needed for the backward pass
+(inputs, im2col matrices, normalized activations, ...) is kept alive, and
+every intermediate activation can be freed as soon as the next layer has
+consumed it:
+
+with no_grad():
+    scores = model.loss(X)
+
+The models in classifiers/ enter no_grad on their own for test-time calls
+loss(X), which includes every call made by Solver.check_accuracy.
+"""
+
+
+_grad_enabled = True
+
+
+def is_grad_enabled():
+    return _grad_enabled
+
+
+def set_grad_enabled(enabled):
+    """
+    Turn cache construction on or off and return the previous setting.
+    """
+    global _grad_enabled
+    previous, _grad_enabled = _grad_enabled, bool(enabled)
+    return previous
+
+
+class no_grad(object):
+    """
+    Context manager that disables cache construction inside its block and
+    restores the previous setting on exit.
+    """
+
+    def __enter__(self):
+        self._previous = set_grad_enabled(False)
+        return self
+
+
+    def __exit__(self, *args):
+        set_grad_enabled(self._previous)
+        return False
@@ -7,8 +7,8 @@ def get_im2col_indices(x_shape, field_height, field_width, padding=1, stride=1):
     N, C, H, W = x_shape
     assert (H + 2 * padding - field_height) % stride == 0
     assert (W + 2 * padding - field_height) % stride == 0
-    out_height = (H + 2 * padding - field_height) / stride + 1
-    out_width = (W + 2 * padding - field_width) / stride + 1
+    out_height = (H + 2 * padding - field_height) // stride + 1
+    out_width = (W + 2 * padding - field_width) // stride + 1
 
     i0 = np.repeat(np.arange(field_height), field_width)
     i0 = np.tile(i0, C)
@@ -53,4 +53,25 @@ def col2im_indices(cols, x_shape, field_height=3, field_width=3, padding=1,
         return x_padded
     return x_padded[:, :, padding:-padding, padding:-padding]
 
-pass
+
+def col2im_6d_numpy(cols, N, C, H, W, HH, WW, pad, stride):
+    """
+    A pure numpy version of col2im_6d_cython.
+
+    cols has shape (C, HH, WW, N, out_h, out_w). Instead of looping over every
+    element, this loops only over the HH * WW filter offsets; for a fixed
+    offset the output positions form a strided slice of the padded image
+    with no repeated elements, so each offset is a single vectorized add.
+    """
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+    x_padded = np.zeros((N, C, H + 2 * pad, W + 2 * pad), dtype=cols.dtype)
+    # View with the same (C, N, ...) axis order as cols
+    x_view = x_padded.transpose(1, 0, 2, 3)
+    for hh in range(HH):
+        for ww in range(WW):
+            x_view[:, :, hh:hh + stride * out_h:stride,
+                   ww:ww + stride * out_w:stride] += cols[:, hh, ww]
+    if pad > 0:
+        return x_padded[:, :, pad:-pad, pad:-pad]
+    return x_padded
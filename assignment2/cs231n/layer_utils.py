@@ -1,6 +1,20 @@
 pass
 from cs231n.layers import *
 from cs231n.fast_layers import *
+from cs231n.dtype_policy import check_dtype
+from cs231n.grad_mode import is_grad_enabled
+
+
+def relu_forward_owned(a):
+    """
+    Same as relu_forward, for an intermediate activation a that belongs to the
+    caller and is not used again. Without gradients (see grad_mode.py) the
+    ReLU is applied in place, so a and the output don't both stay alive.
+    """
+    if is_grad_enabled():
+        return relu_forward(a)
+    np.maximum(a, 0, out=a)
+    return a, None
 
 
 def affine_relu_forward(x, w, b):
@@ -16,7 +30,7 @@ def affine_relu_forward(x, w, b):
     - cache: Object to give to the backward pass
     """
     a, fc_cache = affine_forward(x, w, b)
-    out, relu_cache = relu_forward(a)
+    out, relu_cache = relu_forward_owned(a)
     cache = (fc_cache, relu_cache)
     return out, cache
 
@@ -29,6 +43,99 @@ def affine_relu_backward(dout, cache):
     da = relu_backward(dout, relu_cache)
     dx, dw, db = affine_backward(da, fc_cache)
     return dx, dw, db
+
+
+def affine_bn_relu_forward(x, w, b, gamma, beta, bn_param):
+    """
+    Fused layer that performs an affine transform, batch normalization and a
+    ReLU. It gives the same output as affine_forward, batchnorm_forward and
+    relu_forward in sequence, but works in place on a single (N, M) buffer
+    and keeps only the normalized activations, the inverse standard
+    deviation and a bit-packed ReLU mask for the backward pass.
+
+    Inputs:
+    - x: Input to the affine layer, of shape (N, d_1, ..., d_k)
+    - w, b: Weights for the affine layer
+    - gamma, beta, bn_param: Parameters for the batchnorm layer; see
+      batchnorm_forward.
+
+    Returns a tuple of:
+    - out: Output from the ReLU, of shape (N, M)
+    - cache: Object to give to the backward pass
+    """
+    mode = bn_param['mode']
+    eps = bn_param.get('eps', 1e-5)
+    momentum = bn_param.get('momentum', 0.9)
+
+    a = np.reshape(x, (x.shape[0], -1)).dot(w)
+    a += b
+    N, M = a.shape
+    running_mean = bn_param.get('running_mean', np.zeros(M, dtype=a.dtype))
+    running_var = bn_param.get('running_var', np.zeros(M, dtype=a.dtype))
+
+    cache = None
+    if mode == 'train':
+        mean = a.mean(axis=0)
+        var = a.var(axis=0) + eps
+        std = np.sqrt(var)
+        bn_param['running_mean'] = momentum * running_mean + (1 - momentum) * mean
+        bn_param['running_var'] = momentum * running_var + (1 - momentum) * (std**2)
+
+        # a becomes norm_x in place; out is the only other buffer
+        a -= mean
+        a /= std
+        if is_grad_enabled():
+            out = np.multiply(a, gamma)
+        else:
+            out = np.multiply(a, gamma, out=a)
+        out += beta
+        np.maximum(out, 0, out=out)
+        if is_grad_enabled():
+            relu_mask = np.packbits(out > 0, axis=None)
+            cache = (x, w, a, 1 / std, gamma, relu_mask)
+    elif mode == 'test':
+        out = a
+        out -= running_mean
+        out *= gamma
+        out /= np.sqrt(running_var + eps)
+        out += beta
+        np.maximum(out, 0, out=out)
+    else:
+        raise ValueError('Invalid forward batchnorm mode "%s"' % mode)
+    check_dtype(out, x.dtype, 'affine_bn_relu_forward')
+
+    return out, cache
+
+
+def affine_bn_relu_backward(dout, cache):
+    """
+    Backward pass for the fused affine-batchnorm-relu layer.
+
+    Returns a tuple of:
+    - dx, dw, db: Gradients with respect to the affine layer inputs
+    - dgamma, dbeta: Gradients with respect to the batchnorm parameters
+    """
+    x, w, norm_x, inv_std, gamma, relu_mask = cache
+    N, M = norm_x.shape
+
+    relu_mask = np.unpackbits(relu_mask, count=N * M).reshape(N, M)
+    dy = np.multiply(dout, relu_mask, dtype=dout.dtype)
+    del relu_mask
+    dbeta = dy.sum(axis=0)
+    dgamma = np.einsum('ij,ij->j', dy, norm_x)
+
+    # dy becomes the gradient with respect to the affine output in place
+    dy *= gamma
+    dnorm_sum = dy.sum(axis=0)
+    dnorm_dot = np.einsum('ij,ij->j', dy, norm_x)
+    dy -= dnorm_sum / N
+    dy -= norm_x * (dnorm_dot / N)
+    dy *= inv_std
+
+    dx = dy.dot(w.T).reshape(x.shape)
+    dw = np.reshape(x, (N, -1)).T.dot(dy)
+    db = dy.sum(axis=0)
+    return dx, dw, db, dgamma, dbeta
    
 
 def conv_relu_forward(x, w, b, conv_param):
@@ -44,7 +151,7 @@ def conv_relu_forward(x, w, b, conv_param):
     - cache: Object to give to the backward pass
     """
     a, conv_cache = conv_forward_fast(x, w, b, conv_param)
-    out, relu_cache = relu_forward(a)
+    out, relu_cache = relu_forward_owned(a)
     cache = (conv_cache, relu_cache)
     return out, cache
 
@@ -62,7 +169,7 @@ def conv_relu_backward(dout, cache):
 def conv_bn_relu_forward(x, w, b, gamma, beta, conv_param, bn_param):
     a, conv_cache = conv_forward_fast(x, w, b, conv_param)
     an, bn_cache = spatial_batchnorm_forward(a, gamma, beta, bn_param)
-    out, relu_cache = relu_forward(an)
+    out, relu_cache = relu_forward_owned(an)
     cache = (conv_cache, bn_cache, relu_cache)
     return out, cache
 
@@ -89,7 +196,7 @@ def conv_relu_pool_forward(x, w, b, conv_param, pool_param):
     - cache: Object to give to the backward pass
     """
     a, conv_cache = conv_forward_fast(x, w, b, conv_param)
-    s, relu_cache = relu_forward(a)
+    s, relu_cache = relu_forward_owned(a)
     out, pool_cache = max_pool_forward_fast(s, pool_param)
     cache = (conv_cache, relu_cache, pool_cache)
     return out, cache
@@ -1,6 +1,9 @@
 from builtins import range
 import numpy as np
 
+from cs231n.dtype_policy import check_dtype
+from cs231n.grad_mode import is_grad_enabled
+
 
 def affine_forward(x, w, b):
     """
@@ -27,6 +30,7 @@ def affine_forward(x, w, b):
     ###########################################################################
     x_resh = np.reshape(x, (x.shape[0], -1))
     out = x_resh.dot(w)+b
+    check_dtype(out, x.dtype, 'affine_forward')
     
 #     print("x", x.shape)
 #     print("x_resh.shape", x_resh.shape)
@@ -35,7 +39,7 @@ def affine_forward(x, w, b):
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
-    cache = (x, w, b)
+    cache = (x, w, b) if is_grad_enabled() else None
     return out, cache
 
 
@@ -64,6 +68,7 @@ def affine_backward(dout, cache):
     x_resh = x.reshape(x.shape[0], -1)
     dw = (x_resh.T).dot(dout)
     db = dout.sum(axis=0)
+    check_dtype(dw, w.dtype, 'affine_backward')
     
     
 #     print("dout.shape", dout.shape)
@@ -99,7 +104,7 @@ def relu_forward(x):
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
-    cache = x
+    cache = x if is_grad_enabled() else None
     return out, cache
 
 
@@ -197,10 +202,12 @@ def batchnorm_forward(x, gamma, beta, bn_param):
         std = np.sqrt(var)
         norm_x = (x - ux)/std
         out = gamma * norm_x + beta
+        check_dtype(out, x.dtype, 'batchnorm_forward')
         
         running_mean = momentum * running_mean + (1 - momentum) * ux
         running_var = momentum * running_var + (1 - momentum) * (std**2)
-        cache = {'x':x,'mean':ux,'var':var,'std':std,'norm_x':norm_x,'gamma':gamma,'beta':beta}
+        if is_grad_enabled():
+            cache = {'x':x,'mean':ux,'var':var,'std':std,'norm_x':norm_x,'gamma':gamma,'beta':beta}
         #######################################################################
         #                           END OF YOUR CODE                          #
         #######################################################################
@@ -314,6 +321,29 @@ def batchnorm_backward_alt(dout, cache):
     return dx, dgamma, dbeta
 
 
+def _dropout_mask(key, shape, p):
+    """
+    Return the boolean dropout mask (True where a unit is kept) for the given
+    random key. The mask is drawn from a counter-based Philox generator, so
+    the same key always gives the same mask.
+    """
+    rng = np.random.Generator(np.random.Philox(key))
+    return rng.random(shape, dtype=np.float32) < p
+
+
+def dropout_key(dropout_param):
+    """
+    Return the random key for the next training-time dropout mask: the seed
+    in dropout_param if there is one, else a single draw from the global
+    numpy generator, so np.random.seed still makes training reproducible.
+    Passing the key back in as dropout_param['seed'] reproduces the mask.
+    """
+    if 'seed' in dropout_param:
+        return dropout_param['seed']
+    # An explicit dtype, since the default int is 32 bits on Windows
+    return int(np.random.randint(np.iinfo(np.int64).max, dtype=np.int64))
+
+
 def dropout_forward(x, dropout_param):
     """
     Performs the forward pass for (inverted) dropout.
@@ -327,15 +357,22 @@ def dropout_forward(x, dropout_param):
       - seed: Seed for the random number generator. Passing seed makes this
         function deterministic, which is needed for gradient checking but not
         in real networks.
+      - mask_storage: How the mask is kept for the backward pass. 'packed'
+        (the default) stores it bit-packed with np.packbits, one bit per
+        unit; 'seed' stores only the random key and regenerates the mask in
+        dropout_backward, trading a second mask generation for memory.
 
     Outputs:
     - out: Array of the same shape as x.
-    - cache: tuple (dropout_param, mask). In training mode, mask is the dropout
-      mask that was used to multiply the input; in test mode, mask is None.
+    - cache: tuple (dropout_param, mask). In training mode, mask is a tuple
+      (key, shape, packed) from which dropout_backward recovers the dropout
+      mask, where packed is the bit-packed mask or None; in test mode, mask
+      is None.
     """
     p, mode = dropout_param['p'], dropout_param['mode']
-    if 'seed' in dropout_param:
-        np.random.seed(dropout_param['seed'])
+    storage = dropout_param.get('mask_storage', 'packed')
+    if storage not in ('packed', 'seed'):
+        raise ValueError('Invalid mask_storage "%s"' % storage)
 
     mask = None
     out = None
@@ -345,8 +382,14 @@ def dropout_forward(x, dropout_param):
         # TODO: Implement training phase forward pass for inverted dropout.   #
         # Store the dropout mask in the mask variable.                        #
         #######################################################################
-        mask = (np.random.rand(*x.shape) < p) / p ##inverted dropout
-        out = x * mask
+        key = dropout_key(dropout_param)
+        keep = _dropout_mask(key, x.shape, p)
+        out = np.multiply(x, keep, dtype=x.dtype)
+        out *= x.dtype.type(1) / p ##inverted dropout
+        packed = None
+        if storage == 'packed':
+            packed = np.packbits(keep, axis=None)
+        mask = (key, x.shape, packed)
         #######################################################################
         #                           END OF YOUR CODE                          #
         #######################################################################
@@ -359,7 +402,7 @@ def dropout_forward(x, dropout_param):
         #                            END OF YOUR CODE                         #
         #######################################################################
 
-    cache = (dropout_param, mask)
+    cache = (dropout_param, mask) if is_grad_enabled() else None
     out = out.astype(x.dtype, copy=False)
 
     return out, cache
@@ -381,7 +424,14 @@ def dropout_backward(dout, cache):
         #######################################################################
         # TODO: Implement training phase backward pass for inverted dropout   #
         #######################################################################
-        dx = dout * mask
+        key, shape, packed = mask
+        if packed is None:
+            keep = _dropout_mask(key, shape, dropout_param['p'])
+        else:
+            keep = np.unpackbits(packed, count=int(np.prod(shape)))
+            keep = keep.reshape(shape).view(np.bool_)
+        dx = np.multiply(dout, keep, dtype=dout.dtype)
+        dx *= dout.dtype.type(1) / dropout_param['p']
         #######################################################################
         #                          END OF YOUR CODE                           #
         #######################################################################
@@ -429,14 +479,14 @@ def conv_forward_naive(x, w, b, conv_param):
     # create output 
     Hout = int((H + 2*pad - HH)/stride + 1) ## height
     Wout = int((W + 2*pad - WW)/stride + 1) ## width
-    out = np.zeros((N, F, Hout, Wout)) 
+    out = np.zeros((N, F, Hout, Wout), dtype=x.dtype)
     # padding 
     xpad = np.pad(x, ((0,0), (0,0), (pad,pad), (pad,pad)), 'constant')
     Hpad, Wpad = xpad.shape[2], xpad.shape[3]
     # weight row formation
     w_row = w.reshape(F, C*HH*WW)
     # x column formation
-    x_col = np.zeros((C*HH*WW, Hout*Wout))
+    x_col = np.zeros((C*HH*WW, Hout*Wout), dtype=x.dtype)
     
     for index in range(N):
         neuron = 0 
@@ -477,7 +527,7 @@ def conv_forward_naive(x, w, b, conv_param):
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
-    cache = (x, w, b, conv_param)
+    cache = (x, w, b, conv_param) if is_grad_enabled() else None
     return out, cache
 
 
@@ -505,8 +555,8 @@ def conv_backward_naive(dout, cache):
     ###########################################################################
     # TODO: Implement the convolutional backward pass.                        #
     ###########################################################################
-    dx = np.zeros(x.shape)  # (N, C, H, W)
-    dw = np.zeros(w.shape)  # (F, C, HH, WW)
+    dx = np.zeros(x.shape, dtype=x.dtype)  # (N, C, H, W)
+    dw = np.zeros(w.shape, dtype=w.dtype)  # (F, C, HH, WW)
 
     x_pad = np.pad(x, ((0, 0), (0, 0), (pad, pad), (pad, pad)), 'constant')
     dx_pad = np.pad(dx, ((0, 0), (0, 0), (pad, pad), (pad, pad)), 'constant')
@@ -560,7 +610,7 @@ def max_pool_forward_naive(x, pool_param):
     H_new = int((H - pool_height)/stride + 1)
     W_new = int((H - pool_width)/stride + 1)
 
-    out = np.zeros((N, C, H_new, W_new))
+    out = np.zeros((N, C, H_new, W_new), dtype=x.dtype)
 
     last_row = H - pool_height + 1
     last_col = W - pool_width + 1
@@ -575,7 +625,7 @@ def max_pool_forward_naive(x, pool_param):
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
-    cache = (x, pool_param)
+    cache = (x, pool_param) if is_grad_enabled() else None
     return out, cache
 
 
@@ -602,7 +652,7 @@ def max_pool_backward_naive(dout, cache):
     ###########################################################################
     # TODO: Implement the max pooling backward pass                           #
     ###########################################################################
-    dx = np.zeros(x.shape)
+    dx = np.zeros(x.shape, dtype=x.dtype)
 
     last_row = H - pool_height + 1
     last_col = W - pool_width + 1
@@ -701,6 +751,60 @@ def spatial_batchnorm_backward(dout, cache):
     return dx, dgamma, dbeta
 
 
+def _batchnorm_fold_scale(gamma, beta, bn_param):
+    """
+    Return the per-feature scale and shift that test-time batch normalization
+    with bn_param applies, so that batchnorm(a) = scale * a + shift.
+    """
+    if 'running_mean' not in bn_param or 'running_var' not in bn_param:
+        raise ValueError('bn_param has no running statistics to fold; '
+                         'train the model first')
+    eps = bn_param.get('eps', 1e-5)
+    scale = gamma / np.sqrt(bn_param['running_var'] + eps)
+    shift = beta - bn_param['running_mean'] * scale
+    return scale, shift
+
+
+def affine_batchnorm_fold(w, b, gamma, beta, bn_param):
+    """
+    Fold a test-time batch normalization layer into the affine layer before it.
+
+    Inputs:
+    - w, b: Weights of shape (D, M) and biases of shape (M,) of the affine layer
+    - gamma, beta, bn_param: Parameters of the batchnorm layer; bn_param must
+      hold running_mean and running_var, as after training.
+
+    Returns a tuple of:
+    - w_folded, b_folded: New weights and biases such that
+      affine_forward(x, w_folded, b_folded) gives the same output as
+      affine_forward followed by batchnorm_forward in test mode.
+    """
+    scale, shift = _batchnorm_fold_scale(gamma, beta, bn_param)
+    w_folded = (w * scale).astype(w.dtype, copy=False)
+    b_folded = (b * scale + shift).astype(b.dtype, copy=False)
+    return w_folded, b_folded
+
+
+def conv_batchnorm_fold(w, b, gamma, beta, bn_param):
+    """
+    Fold a test-time spatial batch normalization layer into the convolutional
+    layer before it, e.g. to run a conv_bn_relu_forward layer as a
+    conv_relu_forward layer at test time.
+
+    Inputs:
+    - w, b: Filter weights of shape (F, C, HH, WW) and biases of shape (F,)
+    - gamma, beta, bn_param: Parameters of the spatial batchnorm layer, as in
+      affine_batchnorm_fold.
+
+    Returns a tuple of:
+    - w_folded, b_folded: New filter weights and biases.
+    """
+    scale, shift = _batchnorm_fold_scale(gamma, beta, bn_param)
+    w_folded = (w * scale.reshape(-1, 1, 1, 1)).astype(w.dtype, copy=False)
+    b_folded = (b * scale + shift).astype(b.dtype, copy=False)
+    return w_folded, b_folded
+
+
 def svm_loss(x, y):
     """
     Computes the loss and gradient using for multiclass SVM classification.
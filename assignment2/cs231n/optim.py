@@ -1,5 +1,7 @@
 import numpy as np
 
+from cs231n.dtype_policy import check_dtype
+
 """
 This file implements various first-order update rules that are commonly used
 for training neural networks. Each update rule accepts current weights and the
@@ -40,6 +42,7 @@ def sgd(w, dw, config=None):
     if config is None: config = {}
     config.setdefault('learning_rate', 1e-2)
 
+    check_dtype(dw, w.dtype, 'sgd')
     w -= config['learning_rate'] * dw
     return w, config
 
@@ -71,6 +74,7 @@ def sgd_momentum(w, dw, config=None):
     #                             END OF YOUR CODE                            #
     ###########################################################################
     config['velocity'] = v
+    check_dtype(next_w, w.dtype, 'sgd_momentum')
 
     return next_w, config
 
@@ -105,6 +109,7 @@ def rmsprop(x, dx, config=None):
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
+    check_dtype(next_x, x.dtype, 'rmsprop')
 
     return next_x, config
 
@@ -153,5 +158,263 @@ def adam(x, dx, config=None):
     ###########################################################################
     #                             END OF YOUR CODE                            #
     ###########################################################################
+    check_dtype(next_x, x.dtype, 'adam')
+
+    return next_x, config
+
+
+def _scratch(config, name, x):
+    """
+    Return a scratch array shaped like x that is kept in config between calls
+    so the in-place update rules below don't allocate on every step. Scratch
+    entries start with an underscore; they hold no state and are not saved in
+    checkpoints.
+    """
+    buf = config.get(name)
+    if buf is None or buf.shape != x.shape or buf.dtype != x.dtype:
+        buf = np.empty_like(x)
+        config[name] = buf
+    return buf
+
+
+def sgd_momentum_inplace(w, dw, config=None):
+    """
+    Same as sgd_momentum, but updates w and the velocity in place using
+    preallocated scratch memory, so no model-sized arrays are allocated after
+    the first call. The result is bitwise identical to sgd_momentum.
+
+    config format: Same as sgd_momentum.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-2)
+    config.setdefault('momentum', 0.9)
+    if config.get('velocity') is None:
+        config['velocity'] = np.zeros_like(w)
+    v = config['velocity']
+    s = _scratch(config, '_scratch1', w)
+
+    # v = momentum * v - learning_rate * dw; w = w + v
+    np.multiply(v, config['momentum'], out=v)
+    np.multiply(dw, config['learning_rate'], out=s)
+    np.subtract(v, s, out=v)
+    np.add(w, v, out=w)
+    check_dtype(dw, w.dtype, 'sgd_momentum_inplace')
+
+    return w, config
+
+
+def rmsprop_inplace(x, dx, config=None):
+    """
+    Same as rmsprop, but updates x and the cache in place using preallocated
+    scratch memory, so no model-sized arrays are allocated after the first
+    call. The result is bitwise identical to rmsprop.
+
+    config format: Same as rmsprop.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-2)
+    config.setdefault('decay_rate', 0.99)
+    config.setdefault('epsilon', 1e-8)
+    if config.get('cache') is None:
+        config['cache'] = np.zeros_like(x)
+    cache = config['cache']
+    decay_rate = config['decay_rate']
+    s1 = _scratch(config, '_scratch1', x)
+    s2 = _scratch(config, '_scratch2', x)
+
+    # cache = decay_rate * cache + (1 - decay_rate) * dx * dx
+    np.multiply(cache, decay_rate, out=cache)
+    np.multiply(dx, 1 - decay_rate, out=s1)
+    np.multiply(s1, dx, out=s1)
+    np.add(cache, s1, out=cache)
+
+    # x = x - learning_rate * dx / sqrt(cache + epsilon)
+    np.multiply(dx, config['learning_rate'], out=s1)
+    np.add(cache, config['epsilon'], out=s2)
+    np.sqrt(s2, out=s2)
+    np.divide(s1, s2, out=s1)
+    np.subtract(x, s1, out=x)
+    check_dtype(dx, x.dtype, 'rmsprop_inplace')
+
+    return x, config
+
+
+def adam_inplace(x, dx, config=None):
+    """
+    Same as adam, but updates x and the moment estimates in place using
+    preallocated scratch memory, so no model-sized arrays are allocated after
+    the first call. The result is bitwise identical to adam.
+
+    config format: Same as adam.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-3)
+    config.setdefault('beta1', 0.9)
+    config.setdefault('beta2', 0.999)
+    config.setdefault('epsilon', 1e-8)
+    config.setdefault('t', 1)
+    if config.get('m') is None:
+        config['m'] = np.zeros_like(x)
+    if config.get('v') is None:
+        config['v'] = np.zeros_like(x)
+    m, v = config['m'], config['v']
+    beta1, beta2 = config['beta1'], config['beta2']
+    config['t'] += 1
+    t = config['t']
+    s1 = _scratch(config, '_scratch1', x)
+    s2 = _scratch(config, '_scratch2', x)
+
+    # m = beta1 * m + (1 - beta1) * dx
+    np.multiply(m, beta1, out=m)
+    np.multiply(dx, 1 - beta1, out=s1)
+    np.add(m, s1, out=m)
+
+    # v = beta2 * v + (1 - beta2) * dx * dx
+    np.multiply(v, beta2, out=v)
+    np.multiply(dx, 1 - beta2, out=s1)
+    np.multiply(s1, dx, out=s1)
+    np.add(v, s1, out=v)
+
+    # x = x - learning_rate * m_hat / (sqrt(v_hat) + epsilon)
+    np.divide(m, 1 - beta1**t, out=s1)
+    np.multiply(s1, config['learning_rate'], out=s1)
+    np.divide(v, 1 - beta2**t, out=s2)
+    np.sqrt(s2, out=s2)
+    np.add(s2, config['epsilon'], out=s2)
+    np.divide(s1, s2, out=s1)
+    np.subtract(x, s1, out=x)
+    check_dtype(dx, x.dtype, 'adam_inplace')
+
+    return x, config
+
+
+# Update rules that look at the whole weight array at once (through its norm)
+# rather than at every element on its own. They must be applied to every
+# parameter separately, so they can't be used with Solver(flat_params=True).
+LAYERWISE_RULES = ('lars', 'lamb')
+
+
+def _trust_ratio(w, update):
+    """
+    Return ||w|| / ||update||, or 1 if either norm is zero.
+    """
+    w_norm = np.linalg.norm(w)
+    u_norm = np.linalg.norm(update)
+    if w_norm == 0 or u_norm == 0:
+        return 1.0
+    return w_norm / u_norm
+
+
+def _warmup_lr(config, t):
+    """
+    Return the learning rate for iteration t (starting at 1), linearly warmed
+    up over the first config['warmup_iters'] iterations.
+    """
+    lr = config['learning_rate']
+    if t < config['warmup_iters']:
+        lr *= t / config['warmup_iters']
+    return lr
+
+
+def lars(w, dw, config=None):
+    """
+    Uses LARS (layer-wise adaptive rate scaling), which is SGD with momentum
+    where the learning rate of every weight array is scaled by the ratio of
+    the norm of the weights to the norm of their gradient. Every layer then
+    moves by about the same relative amount per step no matter how large its
+    gradients are, which keeps training stable with very large minibatches.
+
+    config format:
+    - learning_rate: Scalar global learning rate.
+    - momentum: Scalar between 0 and 1 giving the momentum value.
+    - trust_coefficient: Scalar eta; the step of every layer is about eta
+      times learning_rate times the norm of its weights.
+    - weight_decay: Scalar L2 weight decay applied inside the update. Leave
+      this at 0 if the model's loss already includes the regularization.
+    - warmup_iters: Number of iterations over which the learning rate is
+      linearly increased from 0 to learning_rate.
+    - exclude_1d: If True, 1-dimensional arrays (biases, batchnorm gamma
+      and beta) use a plain momentum update without layer-wise scaling.
+    - velocity: A numpy array of the same shape as w and dw used to store a
+      moving average of the gradients.
+    - t: Iteration number.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1.0)
+    config.setdefault('momentum', 0.9)
+    config.setdefault('trust_coefficient', 1e-3)
+    config.setdefault('weight_decay', 0.0)
+    config.setdefault('warmup_iters', 0)
+    config.setdefault('exclude_1d', True)
+    config.setdefault('t', 0)
+    v = config.get('velocity', np.zeros_like(w))
+
+    config['t'] += 1
+    lr = _warmup_lr(config, config['t'])
+    update = dw
+    if config['weight_decay'] > 0:
+        update = dw + config['weight_decay'] * w
+    if w.ndim > 1 or not config['exclude_1d']:
+        lr *= config['trust_coefficient'] * _trust_ratio(w, update)
+
+    v = config['momentum'] * v - lr * update
+    next_w = w + v
+    config['velocity'] = v
+    check_dtype(next_w, w.dtype, 'lars')
+
+    return next_w, config
+
+
+def lamb(x, dx, config=None):
+    """
+    Uses LAMB (layer-wise adaptive moments), which computes the Adam step
+    for every weight array and then rescales it so that its norm is
+    learning_rate times the norm of the weights. This lets Adam-style
+    training scale to very large minibatches.
+
+    config format:
+    - learning_rate: Scalar learning rate.
+    - beta1: Decay rate for moving average of first moment of gradient.
+    - beta2: Decay rate for moving average of second moment of gradient.
+    - epsilon: Small scalar used for smoothing to avoid dividing by zero.
+    - weight_decay: Scalar decoupled weight decay added to the Adam step.
+      Leave this at 0 if the model's loss already includes regularization.
+    - warmup_iters: Number of iterations over which the learning rate is
+      linearly increased from 0 to learning_rate.
+    - exclude_1d: If True, 1-dimensional arrays (biases, batchnorm gamma
+      and beta) take the plain Adam step without layer-wise scaling.
+    - m: Moving average of gradient.
+    - v: Moving average of squared gradient.
+    - t: Iteration number.
+    """
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-3)
+    config.setdefault('beta1', 0.9)
+    config.setdefault('beta2', 0.999)
+    config.setdefault('epsilon', 1e-6)
+    config.setdefault('weight_decay', 0.0)
+    config.setdefault('warmup_iters', 0)
+    config.setdefault('exclude_1d', True)
+    config.setdefault('m', np.zeros_like(x))
+    config.setdefault('v', np.zeros_like(x))
+    config.setdefault('t', 0)
+
+    beta1, beta2 = config['beta1'], config['beta2']
+    t = config['t'] + 1
+    m = beta1 * config['m'] + (1 - beta1) * dx
+    v = beta2 * config['v'] + (1 - beta2) * dx * dx
+    m_biascor = m / (1 - beta1**t)
+    v_biascor = v / (1 - beta2**t)
+    update = m_biascor / (np.sqrt(v_biascor) + config['epsilon'])
+    if config['weight_decay'] > 0:
+        update += config['weight_decay'] * x
+
+    lr = _warmup_lr(config, t)
+    if x.ndim > 1 or not config['exclude_1d']:
+        lr *= _trust_ratio(x, update)
+    next_x = x - lr * update
+
+    config['m'], config['v'], config['t'] = m, v, t
+    check_dtype(next_x, x.dtype, 'lamb')
 
     return next_x, config
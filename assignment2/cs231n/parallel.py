@@ -0,0 +1,281 @@
+from __future__ import print_function, division
+from builtins import range
+from builtins import object
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import traceback
+
+import numpy as np
+
+
+class _SharedFlat(object):
+    """
+    A block of shared memory holding `rows` flat copies of a set of named
+    arrays, with a view of every array in every row.
+    """
+
+    def __init__(self, shapes, dtype, rows=1, name=None):
+        self.shapes = shapes
+        self.dtype = np.dtype(dtype)
+        self.size = sum(int(np.prod(shape)) for shape in shapes.values())
+        nbytes = max(rows * self.size * self.dtype.itemsize, 1)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.flat = np.ndarray((rows, self.size), dtype=self.dtype,
+                               buffer=self.shm.buf)
+        self.views = [self.split(self.flat[i]) for i in range(rows)]
+
+
+    def split(self, flat):
+        """
+        Return a dictionary of views into the 1-D array flat.
+        """
+        views = {}
+        offset = 0
+        for k in sorted(self.shapes):
+            n = int(np.prod(self.shapes[k]))
+            views[k] = flat[offset:offset + n].reshape(self.shapes[k])
+            offset += n
+        return views
+
+
+    def close(self, unlink=False):
+        self.views = self.flat = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _get_bn_state(model):
+    return [{k: bn_param[k] for k in ('running_mean', 'running_var')
+             if k in bn_param} for bn_param in getattr(model, 'bn_params', [])]
+
+
+def _set_bn_state(model, bn_state):
+    for bn_param, state in zip(getattr(model, 'bn_params', []), bn_state):
+        bn_param.update(state)
+
+
+def _open_data(data_spec):
+    X_name, X_shape, X_dtype, y_name, y_dtype = data_spec
+    return (_SharedFlat({'X': X_shape}, X_dtype, name=X_name),
+            _SharedFlat({'y': X_shape[:1]}, y_dtype, name=y_name))
+
+
+def _worker(rank, conn, model, shapes, dtype, param_name, grad_name,
+            num_workers):
+    """
+    Worker process main loop: compute model.loss on the shards described by
+    the messages sent over conn, reading parameters and data from and writing
+    gradients to shared memory.
+    """
+    params = _SharedFlat(shapes, dtype, name=param_name)
+    grads = _SharedFlat(shapes, dtype, rows=num_workers, name=grad_name)
+    model.params = params.views[0]
+    data_spec, data = None, ()
+    try:
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            spec, start, end, seed, bn_state = msg
+            try:
+                if spec != data_spec:
+                    for buf in data:
+                        buf.close()
+                    data_spec, data = spec, _open_data(spec)
+                X = data[0].views[0]['X'][start:end]
+                y = data[1].views[0]['y'][start:end]
+                # Every worker draws its own dropout masks for every shard
+                np.random.seed(seed)
+                _set_bn_state(model, bn_state)
+                loss, shard_grads = model.loss(X, y)
+                for k, v in grads.views[rank].items():
+                    np.copyto(v, shard_grads[k])
+                conn.send(('ok', loss, _get_bn_state(model)))
+            except Exception:
+                conn.send(('error', traceback.format_exc(), None))
+    finally:
+        for buf in data:
+            buf.close()
+        params.close()
+        grads.close()
+        conn.close()
+
+
+class DataParallelModel(object):
+    """
+    A DataParallelModel wraps a model (as described in solver.py) and computes
+    training-time loss and gradients on several worker processes at once.
+
+    Every call to loss(X, y) splits the minibatch into one contiguous shard per
+    worker. The minibatch and the current parameters are copied once into
+    shared memory buffers that every worker reads from, each worker runs
+    model.loss on its shard and
+    writes its gradients into its own slot of a second shared memory buffer,
+    and the main process averages the slots (weighted by shard size) with a
+    single matrix-vector product. The caller then performs a single parameter
+    update on the averaged gradients.
+
+    Because the data loss and the L2 regularization are both averages, the
+    result is the same as running model.loss on the whole minibatch in one
+    process, up to floating point summation order. The exceptions are layers
+    that look at the whole minibatch or draw random numbers: batch
+    normalization uses per-shard statistics (its running averages are
+    averaged over the shards after every step) and dropout masks are drawn
+    independently in each worker. Before every shard a worker seeds its
+    global numpy random state with a seed drawn from the main process, so
+    the masks differ between workers and steps but a run is reproducible
+    from the main process's random state.
+
+    Test-time calls loss(X) run in the main process.
+
+    Example usage:
+
+    parallel_model = DataParallelModel(model, num_workers=8)
+    loss, grads = parallel_model.loss(X_batch, y_batch)
+    parallel_model.close()
+    """
+
+    def __init__(self, model, num_workers):
+        """
+        Inputs:
+        - model: A model object conforming to the API in solver.py. The
+          model is copied into every worker when the workers are started,
+          which happens on the first training-time call to loss().
+        - num_workers: Number of worker processes.
+        """
+        self.model = model
+        self.num_workers = num_workers
+        self._procs = None
+
+
+    @property
+    def params(self):
+        return self.model.params
+
+
+    def _start(self):
+        shapes = {k: v.shape for k, v in self.model.params.items()}
+        dtype = np.result_type(*self.model.params.values())
+        self._shapes = shapes
+        self._shared_params = _SharedFlat(shapes, dtype)
+        self._shared_grads = _SharedFlat(shapes, dtype, rows=self.num_workers)
+        self._shared_X = self._shared_y = None
+
+        self._conns = []
+        self._procs = []
+        for rank in range(self.num_workers):
+            parent_conn, child_conn = mp.Pipe()
+            p = mp.Process(target=_worker, args=(
+                rank, child_conn, self.model, shapes, dtype,
+                self._shared_params.shm.name, self._shared_grads.shm.name,
+                self.num_workers))
+            p.daemon = True
+            p.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(p)
+
+
+    def _share_data(self, X, y):
+        """
+        Copy a minibatch into the shared data buffers, allocating larger ones
+        if needed, and return the description of the buffers that is sent to
+        the workers.
+        """
+        X, y = np.asarray(X), np.asarray(y)
+        N = X.shape[0]
+        shared_X, shared_y = self._shared_X, self._shared_y
+        if (shared_X is None or shared_X.dtype != X.dtype or
+                shared_y.dtype != y.dtype or
+                shared_X.shapes['X'][1:] != X.shape[1:] or
+                shared_X.shapes['X'][0] < N):
+            if shared_X is not None:
+                # Workers still attached keep the memory alive until they
+                # switch to the new buffers
+                shared_X.close(unlink=True)
+                shared_y.close(unlink=True)
+            shared_X = _SharedFlat({'X': X.shape}, X.dtype)
+            shared_y = _SharedFlat({'y': y.shape}, y.dtype)
+            self._shared_X, self._shared_y = shared_X, shared_y
+        shared_X.views[0]['X'][:N] = X
+        shared_y.views[0]['y'][:N] = y
+        return (shared_X.shm.name, shared_X.shapes['X'], shared_X.dtype.str,
+                shared_y.shm.name, shared_y.dtype.str)
+
+
+    def loss(self, X, y=None):
+        """
+        Same API as model.loss; see solver.py.
+        """
+        if y is None:
+            return self.model.loss(X)
+        if self._procs is None:
+            self._start()
+
+        # Broadcast the current parameters
+        for k, v in self._shared_params.views[0].items():
+            np.copyto(v, self.model.params[k])
+
+        # Share the minibatch; workers only receive its bounds
+        data_spec = self._share_data(X, y)
+
+        # Never hand a worker an empty shard
+        N = X.shape[0]
+        num_active = min(self.num_workers, N)
+        bounds = np.linspace(0, N, num_active + 1).astype(int)
+        seeds = np.random.randint(2**32, size=num_active, dtype=np.int64)
+        bn_state = _get_bn_state(self.model)
+        conns = self._conns[:num_active]
+        for i, conn in enumerate(conns):
+            conn.send((data_spec, bounds[i], bounds[i + 1], int(seeds[i]),
+                       bn_state))
+
+        weights = np.diff(bounds) / N
+        loss = 0.0
+        bn_states = []
+        errors = []
+        for i, conn in enumerate(conns):
+            status, shard_loss, shard_bn_state = conn.recv()
+            if status != 'ok':
+                errors.append(shard_loss)
+                continue
+            loss += weights[i] * shard_loss
+            bn_states.append(shard_bn_state)
+        if errors:
+            raise RuntimeError('Worker failed:\n%s' % errors[0])
+
+        # Average the gradients of all shards in one pass over the buffer
+        weights = weights.astype(self._shared_grads.dtype)
+        flat_grads = weights.dot(self._shared_grads.flat[:num_active])
+        grads = self._shared_grads.split(flat_grads)
+
+        # Average the batchnorm running statistics of the shards
+        for i, bn_param in enumerate(getattr(self.model, 'bn_params', [])):
+            for k in ('running_mean', 'running_var'):
+                if k in bn_states[0][i]:
+                    bn_param[k] = np.mean([s[i][k] for s in bn_states], axis=0)
+
+        return loss, grads
+
+
+    def close(self):
+        """
+        Stop the worker processes and release the shared memory.
+        """
+        if self._procs is None:
+            return
+        for conn in self._conns:
+            conn.send(None)
+            conn.close()
+        for p in self._procs:
+            p.join()
+        self._shared_params.close(unlink=True)
+        self._shared_grads.close(unlink=True)
+        if self._shared_X is not None:
+            self._shared_X.close(unlink=True)
+            self._shared_y.close(unlink=True)
+        self._procs = None
@@ -0,0 +1,133 @@
+from __future__ import print_function, division
+from builtins import object
+import time
+
+import numpy as np
+
+
+class StepProfiler(object):
+    """
+    Collects wall-clock timings for the phases of training steps.
+
+    Time is attributed to phases by calling begin() and then mark(phase) at
+    the end of each phase; every mark charges the time since the previous
+    begin() or mark() to the named phase. end_step() closes one training step.
+
+    Example usage:
+
+    profiler = StepProfiler()
+    profiler.begin()
+    X_batch, y_batch = sample()
+    profiler.mark('data')
+    loss, grads = model.loss(X_batch, y_batch)
+    profiler.mark('loss')
+    profiler.end_step(batch_size)
+    """
+
+    def __init__(self):
+        self.step_times = {}
+        self.extra_times = {}
+        self.step_sizes = []
+        self._window_start = 0
+        self._last = None
+        self._step_phases = {}
+
+
+    def begin(self):
+        self._last = time.perf_counter()
+
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self._step_phases[phase] = self._step_phases.get(phase, 0.0) + \
+            (now - self._last)
+        self._last = now
+
+
+    def end_step(self, batch_size):
+        """
+        Record the phase timings accumulated since the last end_step() as
+        one training step over batch_size samples.
+        """
+        for phase, t in self._step_phases.items():
+            self.step_times.setdefault(phase, []).append(t)
+        self._step_phases = {}
+        self.step_sizes.append(batch_size)
+
+
+    def mark_extra(self, phase):
+        """
+        Like mark(), but for work that happens outside training steps (such
+        as checking accuracy); it is reported as a total and a count.
+        """
+        now = time.perf_counter()
+        self.extra_times.setdefault(phase, []).append(now - self._last)
+        self._last = now
+
+
+    def _stats(self, start, end):
+        phases = {}
+        total = 0.0
+        for phase, times in self.step_times.items():
+            t = np.asarray(times[start:end])
+            if t.size == 0:
+                continue
+            total += t.sum()
+            phases[phase] = {
+              'mean': float(t.mean()),
+              'p50': float(np.percentile(t, 50)),
+              'p90': float(np.percentile(t, 90)),
+              'p99': float(np.percentile(t, 99)),
+              'total': float(t.sum()),
+            }
+        num_steps = end - start
+        num_samples = sum(self.step_sizes[start:end])
+        return {
+          'num_steps': num_steps,
+          'steps_per_sec': num_steps / total if total > 0 else 0.0,
+          'samples_per_sec': num_samples / total if total > 0 else 0.0,
+          'phases': phases,
+        }
+
+
+    def window_record(self, iteration):
+        """
+        Return a record of the steps since the previous call to
+        window_record, as a dictionary with keys:
+        - iteration: The iteration number passed in.
+        - num_steps: Number of steps in the window.
+        - steps_per_sec, samples_per_sec: Throughput over the time spent in
+          the timed phases.
+        - phases: Dictionary mapping each phase name to a dictionary with the
+          mean, p50, p90, p99 and total time in seconds per step.
+        """
+        end = len(self.step_sizes)
+        record = self._stats(self._window_start, end)
+        record['iteration'] = iteration
+        self._window_start = end
+        return record
+
+
+    def summary(self):
+        """
+        Return a record like window_record for all steps so far, with an
+        extra 'extra' entry mapping each mark_extra phase to a dictionary
+        with its total time and count.
+        """
+        record = self._stats(0, len(self.step_sizes))
+        record['extra'] = {phase: {'total': float(sum(t)), 'count': len(t)}
+                           for phase, t in self.extra_times.items()}
+        return record
+
+
+def format_record(record):
+    """
+    Format a record from StepProfiler as a single line of text.
+    """
+    parts = ['%.1f steps/s, %.1f samples/s' % (
+             record['steps_per_sec'], record['samples_per_sec'])]
+    for phase in sorted(record['phases']):
+        stats = record['phases'][phase]
+        parts.append('%s p50 %.2fms p90 %.2fms' % (
+                     phase, 1e3 * stats['p50'], 1e3 * stats['p90']))
+    return '; '.join(parts)
@@ -4,11 +4,17 @@ standard_library.install_aliases()
 from builtins import range
 from builtins import object
 import os
-import pickle as pickle
 
 import numpy as np
 
 from cs231n import optim
+from cs231n.checkpoint import CheckpointWriter, read_checkpoint
+from cs231n.data_loader import epoch_batch_indices, permute_rows_inplace
+from cs231n.profiling import StepProfiler, format_record
+
+
+# Key of the optimizer state in Solver.optim_configs when flat_params is True
+FLAT_PARAMS_KEY = '__flat__'
 
 
 class Solver(object):
@@ -52,6 +58,14 @@ class Solver(object):
                     print_every=100)
     solver.train()
 
+    If checkpoint_name is given, training can later be resumed exactly where a
+    checkpoint left off by constructing a Solver with the same arguments and
+    calling restore() before train():
+
+    solver = Solver(model, data, ...same options...)
+    solver.restore('my_checkpoint_epoch_3')
+    solver.train()
+
 
     A Solver works on a model object that must conform to the following API:
 
@@ -105,6 +119,16 @@ class Solver(object):
         - num_epochs: The number of epochs to run for during training.
         - print_every: Integer; training losses will be printed every
           print_every iterations.
+        - profile_every: If not None, time the data sampling, model.loss and
+          parameter update phases of every step and the accuracy checks.
+          Every profile_every iterations a record with steps/sec, samples/sec
+          and per-phase percentiles is appended to solver.profile_records,
+          and at the end of train() a record for the whole run is stored in
+          solver.profile_summary (see profiling.py).
+        - epoch_callback: If not None, a function called as
+          epoch_callback(solver) at the end of every epoch, after the
+          accuracy check and checkpoint. If it returns True, training stops
+          early (the best parameters are still swapped into the model).
         - verbose: Boolean; if set to false then no output will be printed
           during training.
         - num_train_samples: Number of training samples used to check training
@@ -112,7 +136,55 @@ class Solver(object):
         - num_val_samples: Number of validation samples to use to check val
           accuracy; default is None, which uses the entire validation set.
         - checkpoint_name: If not None, then save model checkpoints here every
-          epoch.
+          epoch. Each checkpoint is written on a background thread as
+          <checkpoint_name>_epoch_<epoch>.npz holding the model parameters and
+          a .json file of the same name holding the training metadata.
+        - checkpoint_keep_last: If not None, only keep this many of the most
+          recent checkpoints on disk.
+        - checkpoint_keep_best: If True, also keep the checkpoint with the best
+          validation accuracy when old checkpoints are deleted.
+        - sampler: How minibatches are drawn from X_train when no data_loader
+          is given. 'replacement' (the default) samples each minibatch
+          independently with replacement. 'epoch' draws a random permutation
+          of the training set and slices consecutive minibatches from it,
+          gathering each one through the permutation without copying
+          X_train. Examples left over when the permutation runs out start
+          the first minibatch of the next permutation, so every example is
+          seen once per num_train examples sampled. An epoch is still
+          num_train // batch_size iterations, so the boundaries between
+          permutations drift relative to the epochs.
+        - shuffle_data: Only used with sampler='epoch'. If True, X_train and
+          y_train are physically reordered in place by every new permutation
+          so that minibatches are contiguous views instead of gathers. The
+          arrays passed in data are modified. X_train must be a numpy array
+          (not a LazyImageSplit); default is False.
+        - flat_params: If True, pack all model parameters into a single
+          contiguous buffer (model.params then holds views into it) and the
+          gradients into a second one, and apply the update rule once to the
+          whole buffer instead of once per parameter. Since the update rules
+          in optim.py are elementwise this gives the same result, but a model
+          with many small parameters no longer pays Python and temporary
+          allocation overhead per parameter. The optimizer state is then kept
+          in optim_configs[FLAT_PARAMS_KEY]. The layer-wise rules in
+          optim.LAYERWISE_RULES (lars, lamb) can't be used this way.
+        - accumulation_steps: If greater than 1, split every minibatch into
+          this many micro-batches, run model.loss on each in turn and combine
+          their losses and gradients (weighted by micro-batch size) before a
+          single parameter update. Peak activation memory is then bounded by
+          the micro-batch size while the update matches the full minibatch,
+          except that batch normalization uses per-micro-batch statistics
+          and updates its running averages once per micro-batch.
+        - num_workers: If greater than 1, compute the training loss and
+          gradients of every minibatch on this many worker processes, each
+          working on a shard of the minibatch, and average the gradients
+          through shared memory before the update (see parallel.py). Accuracy
+          checks still run in the main process.
+        - data_loader: If not None, an object with a next_batch() method that
+          returns a tuple (X_batch, y_batch) of training data, such as a
+          PrefetchLoader from data_loader.py. It is used instead of sampling
+          minibatches from X_train and y_train on the training thread. If it
+          has a batch_size attribute it must equal batch_size, and if it has
+          a close() method, train() calls it before returning.
         """
         self.model = model
         self.X_train = data['X_train']
@@ -129,8 +201,20 @@ class Solver(object):
         self.num_train_samples = kwargs.pop('num_train_samples', 1000)
         self.num_val_samples = kwargs.pop('num_val_samples', None)
 
+        self.sampler = kwargs.pop('sampler', 'replacement')
+        self.shuffle_data = kwargs.pop('shuffle_data', False)
+        self.data_loader = kwargs.pop('data_loader', None)
+        self.flat_params = kwargs.pop('flat_params', False)
+        self.accumulation_steps = kwargs.pop('accumulation_steps', 1)
+        self.num_workers = kwargs.pop('num_workers', 1)
+
         self.checkpoint_name = kwargs.pop('checkpoint_name', None)
+        self.checkpoint_keep_last = kwargs.pop('checkpoint_keep_last', None)
+        self.checkpoint_keep_best = kwargs.pop('checkpoint_keep_best', False)
+        self._checkpoint_writer = None
         self.print_every = kwargs.pop('print_every', 10)
+        self.profile_every = kwargs.pop('profile_every', None)
+        self.epoch_callback = kwargs.pop('epoch_callback', None)
         self.verbose = kwargs.pop('verbose', True)
 
         # Throw an error if there are extra keyword arguments
@@ -142,8 +226,30 @@ class Solver(object):
         # name with the actual function
         if not hasattr(optim, self.update_rule):
             raise ValueError('Invalid update_rule "%s"' % self.update_rule)
+        if self.flat_params and self.update_rule in optim.LAYERWISE_RULES:
+            raise ValueError('update_rule "%s" can\'t be used with flat_params'
+                             % self.update_rule)
         self.update_rule = getattr(optim, self.update_rule)
 
+        if self.sampler not in ('replacement', 'epoch'):
+            raise ValueError('Invalid sampler "%s"' % self.sampler)
+        if self.shuffle_data and not isinstance(self.X_train, np.ndarray):
+            raise ValueError('shuffle_data requires X_train to be an array')
+        loader_batch_size = getattr(self.data_loader, 'batch_size',
+                                    self.batch_size)
+        if loader_batch_size != self.batch_size:
+            raise ValueError('data_loader batch_size %d does not match '
+                             'batch_size %d' % (loader_batch_size,
+                                                self.batch_size))
+
+        self._parallel_model = None
+        if self.num_workers > 1:
+            # Imported here since it needs multiprocessing.shared_memory
+            # (Python 3.8+), which single-process training does not
+            from cs231n.parallel import DataParallelModel
+            self._parallel_model = DataParallelModel(self.model,
+                                                     self.num_workers)
+
         self._reset()
 
 
@@ -154,17 +260,57 @@ class Solver(object):
         """
         # Set up some variables for book-keeping
         self.epoch = 0
+        self.iteration = 0
         self.best_val_acc = 0
         self.best_params = {}
         self.loss_history = []
         self.train_acc_history = []
         self.val_acc_history = []
+        self._epoch_order = None
+        self._epoch_pos = None
+        self._data_order = None
+        self._profiler = None
+        self.profile_records = []
+        self.profile_summary = None
+        if self.profile_every is not None:
+            self._profiler = StepProfiler()
 
         # Make a deep copy of the optim_config for each parameter
         self.optim_configs = {}
-        for p in self.model.params:
+        if self.flat_params:
             d = {k: v for k, v in self.optim_config.items()}
-            self.optim_configs[p] = d
+            self.optim_configs[FLAT_PARAMS_KEY] = d
+        else:
+            for p in self.model.params:
+                d = {k: v for k, v in self.optim_config.items()}
+                self.optim_configs[p] = d
+        self._flat_w = None
+        self._flat_dw = None
+        self._flat_dw_views = None
+
+
+    def _pack_params(self):
+        """
+        Move the model parameters into one contiguous buffer, replacing every
+        entry of model.params with a view into it, and allocate a matching
+        gradient buffer. Used when flat_params is True.
+        """
+        params = self.model.params
+        names = sorted(params)
+        dtype = np.result_type(*[params[k] for k in names])
+        size = sum(params[k].size for k in names)
+        self._flat_w = np.empty(size, dtype=dtype)
+        self._flat_dw = np.empty(size, dtype=dtype)
+        self._flat_dw_views = {}
+        offset = 0
+        for k in names:
+            shape, n = params[k].shape, params[k].size
+            w = self._flat_w[offset:offset + n].reshape(shape)
+            w[...] = params[k]
+            params[k] = w
+            self._flat_dw_views[k] = self._flat_dw[offset:offset + n].reshape(
+                shape)
+            offset += n
 
 
     def _step(self):
@@ -172,45 +318,263 @@ class Solver(object):
         Make a single gradient update. This is called by train() and should not
         be called manually.
         """
+        profiler = self._profiler
+        if profiler is not None:
+            profiler.begin()
+
         # Make a minibatch of training data
-        num_train = self.X_train.shape[0]
-        batch_mask = np.random.choice(num_train, self.batch_size)
-        X_batch = self.X_train[batch_mask]
-        y_batch = self.y_train[batch_mask]
+        if self.data_loader is not None:
+            X_batch, y_batch = self.data_loader.next_batch()
+        elif self.sampler == 'epoch':
+            X_batch, y_batch = self._next_epoch_batch()
+        else:
+            num_train = self.X_train.shape[0]
+            batch_mask = np.random.choice(num_train, self.batch_size)
+            X_batch = self.X_train[batch_mask]
+            y_batch = self.y_train[batch_mask]
+
+        if profiler is not None:
+            profiler.mark('data')
 
         # Compute loss and gradient
-        loss, grads = self.model.loss(X_batch, y_batch)
+        if self.accumulation_steps > 1:
+            loss, grads = self._accumulated_loss(X_batch, y_batch)
+        else:
+            loss, grads = self._loss(X_batch, y_batch)
         self.loss_history.append(loss)
+        if profiler is not None:
+            profiler.mark('loss')
 
         # Perform a parameter update
-        for p, w in self.model.params.items():
-            dw = grads[p]
-            config = self.optim_configs[p]
-            next_w, next_config = self.update_rule(w, dw, config)
-            self.model.params[p] = next_w
-            self.optim_configs[p] = next_config
+        if self._flat_w is not None:
+            for p, dw in self._flat_dw_views.items():
+                np.copyto(dw, grads[p])
+            config = self.optim_configs[FLAT_PARAMS_KEY]
+            next_w, next_config = self.update_rule(self._flat_w,
+                                                   self._flat_dw, config)
+            if next_w is not self._flat_w:
+                np.copyto(self._flat_w, next_w)
+            self.optim_configs[FLAT_PARAMS_KEY] = next_config
+        else:
+            for p, w in self.model.params.items():
+                dw = grads[p]
+                config = self.optim_configs[p]
+                next_w, next_config = self.update_rule(w, dw, config)
+                self.model.params[p] = next_w
+                self.optim_configs[p] = next_config
+        if profiler is not None:
+            profiler.mark('update')
+            profiler.end_step(X_batch.shape[0])
+
+
+    def _loss(self, X, y):
+        """
+        Compute the training loss and gradients of a minibatch, on the worker
+        processes if num_workers > 1.
+        """
+        if self._parallel_model is not None:
+            return self._parallel_model.loss(X, y)
+        return self.model.loss(X, y)
+
+
+    def _accumulated_loss(self, X, y):
+        """
+        Compute the loss and gradients of a minibatch as the weighted average
+        of those of accumulation_steps micro-batches.
+        """
+        N = X.shape[0]
+        num_micro = min(self.accumulation_steps, N)
+        bounds = np.linspace(0, N, num_micro + 1).astype(int)
+        loss, grads = 0.0, {}
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            weight = (end - start) / N
+            micro_loss, micro_grads = self._loss(X[start:end], y[start:end])
+            loss += weight * micro_loss
+            for k, g in micro_grads.items():
+                g *= weight
+                if k in grads:
+                    grads[k] += g
+                else:
+                    grads[k] = g
+        return loss, grads
+
+
+    def _next_epoch_batch(self):
+        """
+        Return the next minibatch for sampler='epoch'; see
+        epoch_batch_indices.
+        """
+        num_train = self.X_train.shape[0]
+        if self.shuffle_data:
+            return self._next_shuffled_batch(num_train)
+        batch_mask, self._epoch_order, self._epoch_pos = epoch_batch_indices(
+            self._epoch_order, self._epoch_pos, self.batch_size, num_train,
+            np.random)
+        return self.X_train[batch_mask], self.y_train[batch_mask]
+
+
+    def _shuffle_train(self, perm):
+        """
+        Reorder X_train and y_train in place by perm, keeping track of the
+        order relative to the original data in self._data_order.
+        """
+        permute_rows_inplace([self.X_train, self.y_train], perm)
+        if self._data_order is None:
+            self._data_order = np.arange(len(perm))
+        self._data_order = self._data_order[perm]
+
+
+    def _next_shuffled_batch(self, num_train):
+        """
+        Return the next minibatch for shuffle_data=True: a contiguous slice of
+        the reshuffled data, except for a minibatch that spans two
+        permutations, which is gathered into a copy.
+        """
+        pos = self._epoch_pos
+        if pos is None:
+            self._shuffle_train(np.random.permutation(num_train))
+            pos = 0
+        if pos + self.batch_size <= num_train:
+            self._epoch_pos = pos + self.batch_size
+            return (self.X_train[pos:self._epoch_pos],
+                    self.y_train[pos:self._epoch_pos])
+
+        X_parts, y_parts = [], []
+        needed = self.batch_size
+        while needed > 0:
+            if pos == num_train:
+                # Leftovers must not change under the reshuffle
+                X_parts = [X.copy() for X in X_parts]
+                y_parts = [y.copy() for y in y_parts]
+                self._shuffle_train(np.random.permutation(num_train))
+                pos = 0
+            take = min(needed, num_train - pos)
+            X_parts.append(self.X_train[pos:pos + take])
+            y_parts.append(self.y_train[pos:pos + take])
+            pos += take
+            needed -= take
+        self._epoch_pos = pos
+        return np.concatenate(X_parts), np.concatenate(y_parts)
 
 
     def _save_checkpoint(self):
         if self.checkpoint_name is None: return
+        if self._checkpoint_writer is None:
+            self._checkpoint_writer = CheckpointWriter(
+                keep_last=self.checkpoint_keep_last,
+                keep_best=self.checkpoint_keep_best)
+        # Arrays go to the .npz file and everything else to the .json file
+        arrays = dict(self.model.params)
+        for k, v in self.best_params.items():
+            arrays['best/%s' % k] = v
+        optim_scalars = {}
+        for p, config in self.optim_configs.items():
+            optim_scalars[p] = {}
+            for k, v in config.items():
+                if k.startswith('_'):
+                    # Scratch memory of the in-place update rules
+                    continue
+                if isinstance(v, np.ndarray):
+                    arrays['optim/%s/%s' % (p, k)] = v
+                else:
+                    optim_scalars[p][k] = v
+        for i, bn_param in enumerate(getattr(self.model, 'bn_params', [])):
+            for k in ('running_mean', 'running_var'):
+                if k in bn_param:
+                    arrays['bn/%d/%s' % (i, k)] = bn_param[k]
+        rng_state = np.random.get_state()
+        arrays['rng/keys'] = rng_state[1]
+        if self._epoch_order is not None:
+            arrays['sampler/epoch_order'] = self._epoch_order
+        if self._data_order is not None:
+            arrays['sampler/data_order'] = self._data_order
+
         checkpoint = {
-          'model': self.model,
-          'update_rule': self.update_rule,
+          'model_class': type(self.model).__name__,
+          'update_rule': self.update_rule.__name__,
           'lr_decay': self.lr_decay,
           'optim_config': self.optim_config,
           'batch_size': self.batch_size,
           'num_train_samples': self.num_train_samples,
           'num_val_samples': self.num_val_samples,
           'epoch': self.epoch,
+          'iteration': self.iteration,
+          'best_val_acc': self.best_val_acc,
+          'optim_configs': optim_scalars,
+          'rng_state': [rng_state[0]] + list(rng_state[2:]),
+          'epoch_pos': self._epoch_pos,
           'loss_history': self.loss_history,
           'train_acc_history': self.train_acc_history,
           'val_acc_history': self.val_acc_history,
         }
-        filename = '%s_epoch_%d.pkl' % (self.checkpoint_name, self.epoch)
+        prefix = '%s_epoch_%d' % (self.checkpoint_name, self.epoch)
         if self.verbose:
-            print('Saving checkpoint to "%s"' % filename)
-        with open(filename, 'wb') as f:
-            pickle.dump(checkpoint, f)
+            print('Saving checkpoint to "%s.npz"' % prefix)
+        self._checkpoint_writer.save(prefix, arrays, checkpoint,
+                                     score=self.val_acc_history[-1])
+
+
+    def restore(self, path):
+        """
+        Restore the model parameters and the complete training state from a
+        checkpoint written by this Solver, so that a following call to train()
+        continues exactly as if training had never been interrupted. This
+        covers the optimizer state of every parameter, the best parameters so
+        far, batch normalization running statistics, the epoch and iteration
+        counters, the histories, the minibatch sampler and the global numpy
+        random state. (Minibatches prepared by a data_loader are not part of
+        the checkpoint.)
+
+        The Solver should be constructed with the same model architecture,
+        data and options as the one that wrote the checkpoint.
+
+        Inputs:
+        - path: Path of the checkpoint, with or without the .npz extension.
+        """
+        arrays, meta = read_checkpoint(path)
+
+        for p in self.model.params:
+            self.model.params[p] = arrays[p]
+        self.best_params = {}
+        self.optim_configs = {}
+        for p, config in meta['optim_configs'].items():
+            self.optim_configs[p] = dict(config)
+        bn_params = getattr(self.model, 'bn_params', [])
+        for name, v in arrays.items():
+            parts = name.split('/')
+            if parts[0] == 'best':
+                self.best_params[parts[1]] = v
+            elif parts[0] == 'optim':
+                self.optim_configs[parts[1]][parts[2]] = v
+            elif parts[0] == 'bn':
+                bn_params[int(parts[1])][parts[2]] = v
+
+        self.epoch = meta['epoch']
+        self.iteration = meta['iteration']
+        self.best_val_acc = meta['best_val_acc']
+        self.loss_history = meta['loss_history']
+        self.train_acc_history = meta['train_acc_history']
+        self.val_acc_history = meta['val_acc_history']
+
+        self._epoch_order = arrays.get('sampler/epoch_order')
+        self._epoch_pos = meta['epoch_pos']
+        data_order = arrays.get('sampler/data_order')
+        if data_order is not None or self._data_order is not None:
+            # Undo any shuffling this Solver has already done and apply the
+            # checkpoint's order, in a single in-place reordering
+            num_train = self.X_train.shape[0]
+            current = self._data_order
+            if current is None:
+                current = np.arange(num_train)
+            if data_order is None:
+                data_order = np.arange(num_train)
+            permute_rows_inplace([self.X_train, self.y_train],
+                                 np.argsort(current)[data_order])
+            self._data_order = data_order
+
+        rng_state = meta['rng_state']
+        np.random.set_state((rng_state[0], arrays['rng/keys']) +
+                            tuple(rng_state[1:]))
 
 
     def check_accuracy(self, X, y, num_samples=None, batch_size=100):
@@ -256,14 +620,54 @@ class Solver(object):
 
     def train(self):
         """
-        Run optimization to train the model.
+        Run optimization to train the model. Training starts from
+        self.iteration, which is 0 for a new Solver and is set by restore().
+        """
+        try:
+            self._train()
+        finally:
+            self._close()
+
+
+    def _close(self):
+        """
+        Release the resources held during training, even if it was
+        interrupted.
         """
+        close = getattr(self.data_loader, 'close', None)
+        if close is not None:
+            close()
+
+        # Stop the worker processes and free their shared memory
+        if self._parallel_model is not None:
+            self._parallel_model.close()
+
+        # Write every queued checkpoint and stop the writer thread; as a
+        # daemon thread it would be killed at interpreter exit
+        if self._checkpoint_writer is not None:
+            writer, self._checkpoint_writer = self._checkpoint_writer, None
+            writer.close()
+
+
+    def _train(self):
         num_train = self.X_train.shape[0]
         iterations_per_epoch = max(num_train // self.batch_size, 1)
         num_iterations = self.num_epochs * iterations_per_epoch
 
-        for t in range(num_iterations):
+        if self.flat_params:
+            self._pack_params()
+
+        for t in range(self.iteration, num_iterations):
             self._step()
+            self.iteration = t + 1
+
+            if (self._profiler is not None and
+                    self.iteration % self.profile_every == 0):
+                record = self._profiler.window_record(self.iteration)
+                self.profile_records.append(record)
+                if self.verbose:
+                    print('(Iteration %d / %d) %s' % (
+                           t + 1, num_iterations, format_record(record)))
 
             # Maybe print training loss
             if self.verbose and t % self.print_every == 0:
@@ -283,13 +687,16 @@ class Solver(object):
             first_it = (t == 0)
             last_it = (t == num_iterations - 1)
             if first_it or last_it or epoch_end:
+                if self._profiler is not None:
+                    self._profiler.begin()
                 train_acc = self.check_accuracy(self.X_train, self.y_train,
                     num_samples=self.num_train_samples)
                 val_acc = self.check_accuracy(self.X_val, self.y_val,
                     num_samples=self.num_val_samples)
+                if self._profiler is not None:
+                    self._profiler.mark_extra('check_accuracy')
                 self.train_acc_history.append(train_acc)
                 self.val_acc_history.append(val_acc)
-                self._save_checkpoint()
 
                 if self.verbose:
                     print('(Epoch %d / %d) train acc: %f; val_acc: %f' % (
@@ -302,5 +709,17 @@ class Solver(object):
                     for k, v in self.model.params.items():
                         self.best_params[k] = v.copy()
 
+                self._save_checkpoint()
+
+                if (epoch_end and self.epoch_callback is not None and
+                        self.epoch_callback(self)):
+                    break
+
         # At the end of training swap the best params into the model
         self.model.params = self.best_params
+
+        if self._profiler is not None:
+            self.profile_summary = self._profiler.summary()
+            if self.verbose:
+                print('Profile: %s' % format_record(self.profile_summary))
+
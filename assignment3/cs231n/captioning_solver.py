@@ -111,6 +111,11 @@ class CaptioningSolver(object):
         # name with the actual function
         if not hasattr(optim, self.update_rule):
             raise ValueError('Invalid update_rule "%s"' % self.update_rule)
+        if (getattr(self.model, 'sparse_embed_grad', False) and
+                self.update_rule not in optim.SPARSE_RULES):
+            raise ValueError('update_rule "%s" can\'t be used with '
+                             'sparse_embed_grad; use one of %s' % (
+                             self.update_rule, ', '.join(optim.SPARSE_RULES)))
         self.update_rule = getattr(optim, self.update_rule)
 
         self._reset()
@@ -19,7 +19,8 @@ class CaptioningRNN(object):
     """
 
     def __init__(self, word_to_idx, input_dim=512, wordvec_dim=128,
-                 hidden_dim=128, cell_type='rnn', dtype=np.float32):
+                 hidden_dim=128, cell_type='rnn', dtype=np.float32,
+                 sparse_embed_grad=False):
         """
         Construct a new CaptioningRNN instance.
 
@@ -32,12 +33,17 @@ class CaptioningRNN(object):
         - cell_type: What type of RNN to use; either 'rnn' or 'lstm'.
         - dtype: numpy datatype to use; use float32 for training and float64 for
           numeric gradient checking.
+        - sparse_embed_grad: If True, the gradient of W_embed returned by loss
+          is a SparseRows object holding only the rows of the words in the
+          minibatch; train with an update rule that accepts it, such as sgd or
+          lazy_adam.
         """
         if cell_type not in {'rnn', 'lstm'}:
             raise ValueError('Invalid cell_type "%s"' % cell_type)
 
         self.cell_type = cell_type
         self.dtype = dtype
+        self.sparse_embed_grad = sparse_embed_grad
         self.word_to_idx = word_to_idx
         self.idx_to_word = {i: w for w, i in word_to_idx.items()}
         self.params = {}
@@ -162,7 +168,10 @@ class CaptioningRNN(object):
         elif self.cell_type == 'lstm':
             dx, dh0, dWx, dWh, db = lstm_backward(dhh, cache_h)
             
-        dW_embed = word_embedding_backward(dx, cache_word)
+        if self.sparse_embed_grad:
+            dW_embed = word_embedding_backward_sparse(dx, cache_word)
+        else:
+            dW_embed = word_embedding_backward(dx, cache_word)
         dW_proj = features.T.dot(dh0)
         db_proj = dh0.sum(axis=0)
         
@@ -1,5 +1,7 @@
 import numpy as np
 
+from cs231n.rnn_layers import SparseRows
+
 """
 This file implements various first-order update rules that are commonly used for
 training neural networks. Each update rule accepts current weights and the
@@ -27,9 +29,24 @@ for a variety of different problems.
 
 For efficiency, update rules may perform in-place updates, mutating w and
 setting next_w equal to w.
+
+The gradient dw of an embedding matrix may also be a SparseRows object (see
+rnn_layers.py) that only holds the rows touched by the minibatch; the rules
+in SPARSE_RULES accept these and only update those rows, and the others raise
+a ValueError.
 """
 
 
+# Update rules that accept SparseRows gradients
+SPARSE_RULES = ('sgd', 'lazy_adam')
+
+
+def _check_dense(dw, rule):
+    if isinstance(dw, SparseRows):
+        raise ValueError('%s does not support SparseRows gradients; use one '
+                         'of %s' % (rule, ', '.join(SPARSE_RULES)))
+
+
 def sgd(w, dw, config=None):
     """
     Performs vanilla stochastic gradient descent.
@@ -40,6 +57,10 @@ def sgd(w, dw, config=None):
     if config is None: config = {}
     config.setdefault('learning_rate', 1e-2)
 
+    if isinstance(dw, SparseRows):
+        w[dw.indices] -= config['learning_rate'] * dw.values
+        return w, config
+
     w -= config['learning_rate'] * dw
     return w, config
 
@@ -58,6 +79,7 @@ def adam(x, dx, config=None):
     - v: Moving average of squared gradient.
     - t: Iteration number.
     """
+    _check_dense(dx, 'adam')
     if config is None: config = {}
     config.setdefault('learning_rate', 1e-3)
     config.setdefault('beta1', 0.9)
@@ -81,3 +103,42 @@ def adam(x, dx, config=None):
     next_x = x
 
     return next_x, config
+
+
+def lazy_adam(x, dx, config=None):
+    """
+    A variant of Adam for sparse gradients. If dx is a SparseRows object, only
+    the rows of x that have a gradient are updated, along with the moving
+    averages for those rows; rows that are not touched by the minibatch keep
+    their moving averages unchanged instead of decaying them. The cost of an
+    update is then proportional to the number of rows in dx rather than to
+    the number of rows in x. The bias correction uses the global iteration
+    number t. For dense dx this is the same as adam.
+
+    config format is the same as for adam.
+    """
+    if not isinstance(dx, SparseRows):
+        return adam(x, dx, config)
+
+    if config is None: config = {}
+    config.setdefault('learning_rate', 1e-3)
+    config.setdefault('beta1', 0.9)
+    config.setdefault('beta2', 0.999)
+    config.setdefault('epsilon', 1e-8)
+    config.setdefault('m', np.zeros_like(x))
+    config.setdefault('v', np.zeros_like(x))
+    config.setdefault('t', 0)
+
+    beta1, beta2, eps = config['beta1'], config['beta2'], config['epsilon']
+    t, m, v = config['t'], config['m'], config['v']
+    idx, g = dx.indices, dx.values
+    m_rows = beta1 * m[idx] + (1 - beta1) * g
+    v_rows = beta2 * v[idx] + (1 - beta2) * (g * g)
+    t += 1
+    alpha = config['learning_rate'] * np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t)
+    x[idx] -= alpha * (m_rows / (np.sqrt(v_rows) + eps))
+    m[idx] = m_rows
+    v[idx] = v_rows
+    config['t'] = t
+
+    return x, config
@@ -1,5 +1,6 @@
 from __future__ import print_function, division
 from builtins import range
+from builtins import object
 import numpy as np
 
 
@@ -246,6 +247,56 @@ def word_embedding_backward(dout, cache):
     return dW
 
 
+class SparseRows(object):
+    """
+    A gradient that is zero everywhere except on a few rows, such as the
+    gradient of a word embedding matrix, which is nonzero only for the words
+    that appear in the minibatch.
+
+    Attributes:
+    - indices: Sorted integer array of shape (K,) of distinct row indices.
+    - values: Array of shape (K, D) giving the gradient for those rows.
+    - shape: Shape (V, D) of the dense gradient.
+    """
+
+    def __init__(self, indices, values, shape):
+        self.indices = indices
+        self.values = values
+        self.shape = shape
+
+
+    def toarray(self):
+        """
+        Return the gradient as a dense array of shape self.shape.
+        """
+        dense = np.zeros(self.shape, dtype=self.values.dtype)
+        dense[self.indices] = self.values
+        return dense
+
+
+def word_embedding_backward_sparse(dout, cache):
+    """
+    Backward pass for word embeddings that returns the gradient of the word
+    embedding matrix as a SparseRows object. This costs time and memory
+    proportional to the number of words in the minibatch rather than to the
+    size of the vocabulary.
+
+    Inputs:
+    - dout: Upstream gradients of shape (N, T, D)
+    - cache: Values from the forward pass
+
+    Returns:
+    - dW: SparseRows gradient of the word embedding matrix, of shape (V, D).
+    """
+    N, T, D = dout.shape
+    x, W = cache
+
+    indices, inverse = np.unique(x, return_inverse=True)
+    values = np.zeros((indices.shape[0], D), dtype=dout.dtype)
+    np.add.at(values, inverse.ravel(), dout.reshape(N * T, D))
+    return SparseRows(indices, values, W.shape)
+
+
 def sigmoid(x):
     """
     A numerically stable version of the logistic sigmoid function.